@@ -5,28 +5,73 @@
 #include "pico/stdlib.h"
 #include "hardware/uart.h"
 #include "hardware/adc.h"
+#include "hardware/dma.h"
+#include "hardware/irq.h"
+#include "hardware/sync.h"
 
 #define UART_ID uart0
 #define BAUDRATE 115200
+// The RP2040 has 4 ADC inputs, more channels are obtained with more boards (merged by the Raspberry Pi)
 #define NUMBER_OF_CHANNELS 4
 #define NUMBER_OF_TOTAL_SAMPLES 1000
-#define ADC_DELAY_US -2000
-
-// Value for conversion
-const float CONVERSION_FACTOR = 3.3f * 1000 / (1 << 12);
-
-// Array to store values of the samples
-uint16_t values_mv[NUMBER_OF_CHANNELS][NUMBER_OF_TOTAL_SAMPLES];
-// Flag of sampling done
-static bool sampling_done = false;
+#define SAMPLING_FREQUENCY 500
+
+// The ADC converts the channels in round robin, so one sample of every channel takes NUMBER_OF_CHANNELS conversions.
+// A conversion takes (1 + divider) cycles of the 48 MHz ADC clock
+#define ADC_CLOCK_HZ 48000000.0f
+#define ADC_CLOCK_DIVIDER (ADC_CLOCK_HZ / (SAMPLING_FREQUENCY * NUMBER_OF_CHANNELS) - 1)
+#define ADC_CHANNEL_MASK ((1 << NUMBER_OF_CHANNELS) - 1)
+#define SAMPLES_PER_BUFFER (NUMBER_OF_CHANNELS * NUMBER_OF_TOTAL_SAMPLES)
+// Time it takes to fill one buffer
+#define BUFFER_DURATION_US ((uint32_t) ((uint64_t) NUMBER_OF_TOTAL_SAMPLES * 1000000 / SAMPLING_FREQUENCY))
+
+// Set to 1 to send packed binary frames instead of JSON
+#ifndef USE_BINARY_FRAMES
+#define USE_BINARY_FRAMES 0
+#endif
+
+// Binary frame layout (little-endian):
+// magic (2) | version (1) | channels (1) | sequence (4) | timestamp (4) | samples (2) | samples[channels][samples] (2 each) | crc16 (2)
+// The timestamp is the time of the first sample in microseconds of the board clock (time_us_32)
+#define FRAME_MAGIC_0 0xB1
+#define FRAME_MAGIC_1 0xA5
+#define FRAME_VERSION 2
+#define FRAME_HEADER_BYTES 14
+#define FRAME_CRC_BYTES 2
+#define FRAME_TOTAL_BYTES (FRAME_HEADER_BYTES + NUMBER_OF_CHANNELS * NUMBER_OF_TOTAL_SAMPLES * 2 + FRAME_CRC_BYTES)
+
+// Amount of bytes of the JSON
+#define TOTAL_BYTES_TO_SEND (sizeof("{}\n") /* Considering null character */ \
+                             + (sizeof("\"ch0\":[],") - sizeof("")) * NUMBER_OF_CHANNELS /* Excluding null character */ \
+                             + (sizeof("0000,") - sizeof("")) * NUMBER_OF_TOTAL_SAMPLES * NUMBER_OF_CHANNELS /* Excluding null characters */ \
+                             - (NUMBER_OF_CHANNELS + 1)) /* Excluding commas */
+
+// The samples are sent as raw 12-bit ADC counts, the Raspberry Pi converts them
+// (3.3 V / 4096 counts by default, with a gain and offset per channel)
+
+// Two buffers of interleaved samples (ch0, ch1, ch2, ch3, ch0, ...).
+// The DMA fills one while the other one is being sent, so the sampling never stops
+uint16_t adc_buffers[2][SAMPLES_PER_BUFFER];
+// DMA channels which fill each buffer, chained to each other
+static int dma_channels[2];
+// Buffer ready to be sent (-1 if none), its sequence number and the time of its first sample
+static volatile int ready_buffer = -1;
+static volatile uint32_t ready_sequence = 0;
+static volatile uint32_t ready_timestamp = 0;
+// Blocks acquired, used as sequence number (a block which wasn't sent in time leaves a gap the host counts)
+static volatile uint32_t acquired_blocks = 0;
 
 // Funcion prototypes
 void init_uart(uint8_t tx_pin, uint8_t rx_pin);
 void init_adc(uint8_t adc_channel_0, uint8_t adc_channel_1, uint8_t adc_channel_2, uint8_t adc_channel_3);
-bool read_adc(struct repeating_timer *t);
+void init_dma(void);
+void dma_handler(void);
 void start_sampling(void);
-void build_json(char *data, uint total_bytes);
+uint build_json(char *data, const uint16_t *samples);
 void send_data(char *data);
+uint16_t crc16_ccitt(const uint8_t *data, uint length);
+uint build_frame(uint8_t *frame, uint32_t sequence, uint32_t timestamp, const uint16_t *samples);
+void send_frame(const uint8_t *frame, uint length);
 
 int main(void) {
     // Pins for ADC
@@ -39,34 +84,49 @@ int main(void) {
     const uint8_t UART_TX_PIN = 0;
     const uint8_t UART_RX_PIN = 1;
 
-    // Amount of bytes to send
-    uint TOTAL_BYTES_TO_SEND = sizeof("{}\n") // Considering null character
-                               + (sizeof("\"ch0\":[],") - sizeof("")) * NUMBER_OF_CHANNELS // Excluding null character
-                               + (sizeof("0000,") - sizeof("")) * NUMBER_OF_TOTAL_SAMPLES * NUMBER_OF_CHANNELS // Excluding null characters
-                               - (NUMBER_OF_CHANNELS + 1); // Excluding commas
-
+#if USE_BINARY_FRAMES
+    // Binary frame to send
+    static uint8_t frame_to_send[FRAME_TOTAL_BYTES];
+#else
     // JSON data to send
-    char data_to_send[TOTAL_BYTES_TO_SEND];
+    static char data_to_send[TOTAL_BYTES_TO_SEND];
+#endif
 
     stdio_init_all();
     // Initialize UART
     init_uart(UART_TX_PIN, UART_RX_PIN);
     // Initialize ADC
     init_adc(ADC_PIN_CHANNEL_0, ADC_PIN_CHANNEL_1, ADC_PIN_CHANNEL_2, ADC_PIN_CHANNEL_3);
-    // Start the sampling
+    // Initialize the DMA channels which move the ADC values to the buffers
+    init_dma();
+    // Start the sampling, it doesn't stop anymore
     start_sampling();
 
     while (true) {
-        if (sampling_done) {
-            //printf("Sampling done\n");
+        // Take the buffer which was just filled with its sequence and timestamp, without the DMA interrupt in between
+        uint32_t interrupts = save_and_disable_interrupts();
+        int buffer = ready_buffer;
+        uint32_t sequence = ready_sequence;
+        uint32_t timestamp = ready_timestamp;
+        ready_buffer = -1;
+        restore_interrupts(interrupts);
+
+        if (buffer >= 0) {
+            // The other buffer is being filled meanwhile
+            const uint16_t *samples = adc_buffers[buffer];
+#if USE_BINARY_FRAMES
+            // Pack the samples in a binary frame and send it
+            uint frame_length = build_frame(frame_to_send, sequence, timestamp, samples);
+            send_frame(frame_to_send, frame_length);
+#else
             // Make the JSON to send it
-            build_json(data_to_send, TOTAL_BYTES_TO_SEND);
+            (void) sequence;
+            (void) timestamp;
+            build_json(data_to_send, samples);
             //printf("JSON: %s\n", data_to_send);
             // Send the JSON
             send_data(data_to_send);
-            // Clear sampling flag and restart sampling
-            sampling_done = false;
-            start_sampling();
+#endif
         }
     }
 
@@ -88,81 +148,90 @@ void init_adc(uint8_t adc_channel_0, uint8_t adc_channel_1, uint8_t adc_channel_
     adc_gpio_init(adc_channel_1);
     adc_gpio_init(adc_channel_2);
     adc_gpio_init(adc_channel_3);
+
+    // Convert every channel one after the other, starting from channel 0
+    adc_select_input(0);
+    adc_set_round_robin(ADC_CHANNEL_MASK);
+    // Each conversion goes to the FIFO and asks the DMA for a transfer (12 bits, no error flag)
+    adc_fifo_setup(true, true, 1, false, false);
+    // Free running conversions at SAMPLING_FREQUENCY for each channel
+    adc_set_clkdiv(ADC_CLOCK_DIVIDER);
 }
 
-// Calback of the timer
-bool read_adc(struct repeating_timer *t) {
-    // Counter of sampling
-    static uint sampling_count = 0;
+void init_dma(void) {
+    // Both channels are needed before configuring them because each one chains to the other
+    for (int i = 0; i < 2; i++) {
+        dma_channels[i] = dma_claim_unused_channel(true);
+    }
 
-    // Verify that the count doesn't exceed the total number of samples
-    if (sampling_count >= NUMBER_OF_TOTAL_SAMPLES) {
-        // Set the values after having completed the sampling
-        sampling_done = true;
-        cancel_repeating_timer(t);
-        sampling_count = 0;
-    } else {
-        for (int channel = 0; channel < NUMBER_OF_CHANNELS; channel++) {
-            // Read ADC channel
-            adc_select_input(channel);
-            uint16_t adc_value = adc_read();
-            // Convert it to mV
-            values_mv[channel][sampling_count] = round(adc_value * CONVERSION_FACTOR);
+    for (int i = 0; i < 2; i++) {
+        dma_channel_config config = dma_channel_get_default_config(dma_channels[i]);
+        // Read always the ADC FIFO and write the buffer in order
+        channel_config_set_transfer_data_size(&config, DMA_SIZE_16);
+        channel_config_set_read_increment(&config, false);
+        channel_config_set_write_increment(&config, true);
+        // Paced by the ADC
+        channel_config_set_dreq(&config, DREQ_ADC);
+        // When a buffer is full the other channel starts immediately, so no conversion is lost
+        channel_config_set_chain_to(&config, dma_channels[1 - i]);
+        dma_channel_configure(dma_channels[i], &config, adc_buffers[i], &adc_hw->fifo, SAMPLES_PER_BUFFER, false);
+        dma_channel_set_irq0_enabled(dma_channels[i], true);
+    }
+
+    irq_set_exclusive_handler(DMA_IRQ_0, dma_handler);
+    irq_set_enabled(DMA_IRQ_0, true);
+}
+
+// Called when one of the buffers is full
+void dma_handler(void) {
+    for (int i = 0; i < 2; i++) {
+        if (dma_channel_get_irq0_status(dma_channels[i])) {
+            dma_channel_acknowledge_irq0(dma_channels[i]);
+            // Rewind the channel, it will be triggered again by the other one
+            dma_channel_set_write_addr(dma_channels[i], adc_buffers[i], false);
+
+            ready_sequence = acquired_blocks++;
+            // The last conversion just finished, the first one was a buffer earlier
+            ready_timestamp = time_us_32() - BUFFER_DURATION_US;
+            ready_buffer = i;
         }
-        // Next sample
-        sampling_count++;
     }
-    return true;
 }
 
 void start_sampling(void) {
-    // Start timer for sampling
-    static struct repeating_timer timer;
-    sampling_done = false;
-    // Set the read_adc functon as callback with sample delay of 2000 us in order to have 500 Hz of sampling frequency
-    add_repeating_timer_us(ADC_DELAY_US, read_adc, NULL, &timer);
+    // The first buffer is filled first, then the channels alternate forever
+    dma_channel_start(dma_channels[0]);
+    adc_run(true);
 }
 
-// Function which transforms the adc_data to a JSON
-void build_json(char *data, uint total_bytes) {
-    // Stores the total number of bytes for the JSON
-    char *str = (char*) malloc(total_bytes);
-    if (str == NULL) {
-        printf("Memory allocation failed\n");
-        return;
-    }
+// Function which transforms the adc_data to a JSON, returns its length
+uint build_json(char *data, const uint16_t *samples) {
+    // Write position, each sprintf continues where the previous one ended
+    char *str = data;
 
-    strcpy(str, "{");
+    *str++ = '{';
     // Print each value of the ADC channel until completing all channels with all the samplings
     for (int channel = 0; channel < NUMBER_OF_CHANNELS; channel++) {
-        // Create the channel label
-        char label[8];
-        sprintf(label, "\"ch%d\":[", channel);
-
-        // Concatenate the channel label to the JSON string
-        strcat(str, label);
-
-        // Create an auxiliary array
-        char aux[sizeof("0000,")];
+        // Print the channel label
+        str += sprintf(str, "\"ch%d\":[", channel);
 
         // Print the values for the channel array
         for (int sampling_number = 0; sampling_number < NUMBER_OF_TOTAL_SAMPLES; sampling_number++) {
+            uint16_t value = samples[sampling_number * NUMBER_OF_CHANNELS + channel];
             if (sampling_number < NUMBER_OF_TOTAL_SAMPLES - 1) {
-                sprintf(aux, "%d,", values_mv[channel][sampling_number]);
+                str += sprintf(str, "%d,", value);
             } else {
-                sprintf(aux, "%d", values_mv[channel][sampling_number]);
+                str += sprintf(str, "%d", value);
             }
-            strcat(str, aux);
         }
 
         if (channel < NUMBER_OF_CHANNELS - 1) {
-            strcat(str, "],");
+            str += sprintf(str, "],");
         } else {
-            strcat(str, "]}\n");
+            str += sprintf(str, "]}\n");
         }
     }
-    strcpy(data, str);
-    free(str);
+    return str - data;
 }
 
 // Send data by UART
@@ -170,6 +239,59 @@ void send_data(char *data) {
     uart_puts(UART_ID, data);
 }
 
+// CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF)
+uint16_t crc16_ccitt(const uint8_t *data, uint length) {
+    uint16_t crc = 0xFFFF;
+    for (uint i = 0; i < length; i++) {
+        crc ^= (uint16_t) data[i] << 8;
+        for (int bit = 0; bit < 8; bit++) {
+            crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+        }
+    }
+    return crc;
+}
+
+// Function which packs the adc_data in a binary frame, returns its length
+uint build_frame(uint8_t *frame, uint32_t sequence, uint32_t timestamp, const uint16_t *samples) {
+    uint index = 0;
+
+    // Header
+    frame[index++] = FRAME_MAGIC_0;
+    frame[index++] = FRAME_MAGIC_1;
+    frame[index++] = FRAME_VERSION;
+    frame[index++] = NUMBER_OF_CHANNELS;
+    frame[index++] = sequence & 0xFF;
+    frame[index++] = (sequence >> 8) & 0xFF;
+    frame[index++] = (sequence >> 16) & 0xFF;
+    frame[index++] = (sequence >> 24) & 0xFF;
+    frame[index++] = timestamp & 0xFF;
+    frame[index++] = (timestamp >> 8) & 0xFF;
+    frame[index++] = (timestamp >> 16) & 0xFF;
+    frame[index++] = (timestamp >> 24) & 0xFF;
+    frame[index++] = NUMBER_OF_TOTAL_SAMPLES & 0xFF;
+    frame[index++] = (NUMBER_OF_TOTAL_SAMPLES >> 8) & 0xFF;
+
+    // Samples, channel after channel (the buffer is interleaved)
+    for (int channel = 0; channel < NUMBER_OF_CHANNELS; channel++) {
+        for (int sampling_number = 0; sampling_number < NUMBER_OF_TOTAL_SAMPLES; sampling_number++) {
+            uint16_t value = samples[sampling_number * NUMBER_OF_CHANNELS + channel];
+            frame[index++] = value & 0xFF;
+            frame[index++] = (value >> 8) & 0xFF;
+        }
+    }
+
+    // CRC of header and samples
+    uint16_t crc = crc16_ccitt(frame, index);
+    frame[index++] = crc & 0xFF;
+    frame[index++] = (crc >> 8) & 0xFF;
+
+    return index;
+}
+
+// Send binary frame by UART
+void send_frame(const uint8_t *frame, uint length) {
+    uart_write_blocking(UART_ID, frame, length);
+}
 
 /*
 // This code works
@@ -1,33 +1,57 @@
 from bias_dsp import FilterBias, ProcessingBias
 from bias_reception import ReceptionBias
 import numpy as np
+import threading
 from bias_graphing import GraphingBias
 from bias_motors import MotorBias
 from bias_ai import AIBias
+from bias_recorder import RecorderBias
+from bias_latency import LatencyTracerBias, print_latency_summary
+from bias_queue import StageQueueBias
 
 class BiasClass:
     # Constructor
-    def __init__(self, n, fs, channels, port, baudrate, timeout):
+    def __init__(self, n, fs, channels, port, baudrate, timeout, protocol='auto', hop=None, record_path=None,
+                 latency_report_interval=100, latest_only=True, graph_queue_size=2, graph_policy='drop_oldest',
+                 decimate_to=None, actuate=False):
         # Define propieties for the class
         self._n = n
         self._fs = fs
         self._number_of_channels = channels
         self._duration = self._n / self._fs
+        # New samples between two decisions (n means disjoint windows)
+        self._hop = hop if hop is not None else n
         self._port = port
         self._baudrate = baudrate
         self._timeout = timeout
+        self._protocol = protocol
+        # The decisions always use the newest window, windows that couldn't be processed in time are skipped
+        self._latest_only = latest_only
+        # The motors only move with actuate=True, otherwise the commands are only predicted
+        self._actuate = actuate
         self._commands = ["forward", "backwards", "left", "right", "stop", "rest"]
         self._samples_trainig_command = 100
 
         # Create objects as propieties in order to apply the rest of the code in Bias class
-        self._biasReception = ReceptionBias(self._port, self._baudrate, self._timeout)
-        self._biasFilter = FilterBias(n=self._n, fs=self._fs, notch=True, bandpass=True, fir=False, iir=False)
-        self._biasProcessing = ProcessingBias(n=self._n, fs=self._fs)
+        # Raw samples are only saved if a path for the recording is given
+        self._biasRecorder = RecorderBias(record_path, self._number_of_channels, self._fs) if record_path else None
+        self._biasReception = ReceptionBias(self._port, self._baudrate, self._timeout, protocol=self._protocol,
+                                            recorder=self._biasRecorder, fs=self._fs)
+        # The filtered signals can be decimated (e.g. to 125 Hz), processing and AI follow the rate of the filter
+        self._biasFilter = FilterBias(n=self._n, fs=self._fs, notch=True, bandpass=True, fir=False, iir=False,
+                                      decimate_to=decimate_to)
+        self._biasProcessing = ProcessingBias(n=self._n, fs=self._fs, filter_instance=self._biasFilter)
         self._biasGraphing = GraphingBias(graph_in_terminal=True)
         self._biasMotor = MotorBias(echo_forward=18, trigger_forward=17, echo_backwards=23, trigger_backwards=22, echo_right=5, trigger_right=6,
                                     echo_left=25, trigger_left=24, led_forward=16, led_backwards=20, led_left=21, led_right=26, buzzer=12, motor1_in1=13, 
                                     motor1_in2=19, motor2_in1=7, motor2_in2=8)
-        self._biasAI = AIBias(self._n, self._fs, self._number_of_channels, self._commands)
+        self._biasAI = AIBias(self._n, self._fs, self._number_of_channels, self._commands,
+                              processing_instance=self._biasProcessing)
+        # Latency of each stage from the ADC to the motors, printed every latency_report_interval windows
+        self._biasLatency = LatencyTracerBias(callback=print_latency_summary, interval=latency_report_interval)
+        # The graphs are drawn by another thread, so a slow terminal never delays the motors
+        self._graphQueue = StageQueueBias(maxsize=graph_queue_size, policy=graph_policy)
+        self._graphThread = None
 
     def train_ai_model(self, save_path, saved_dataset_path):
         self._biasAI.collect_and_train(reception_instance=self._biasReception, filter_instance=self._biasFilter,
@@ -35,38 +59,90 @@ class BiasClass:
                                        samples_per_command=self._samples_trainig_command, save_path=save_path,
                                        saved_dataset_path=saved_dataset_path, real_data=True)
 
+    # Windows skipped by the decision loop, graphs dropped and samples overwritten before being read
+    def get_backpressure_stats(self):
+        reception_stats = self._biasReception.get_stats()
+        return {
+            'skipped_windows': reception_stats['skipped_windows'],
+            'overrun_samples': reception_stats.get('overrun_samples', 0),
+            'graph_queue': self._graphQueue.snapshot(),
+        }
+
     def app_run(self):
+        # Keep the serial port (and the recording) open for the whole run
+        if self._biasRecorder is not None:
+            self._biasRecorder.open()
+        self._biasReception.start_session(channels=self._number_of_channels)
+        self._graphThread = threading.Thread(target=self._graph_loop, name="BiasGraphing", daemon=True)
+        self._graphThread.start()
+        try:
+            self._app_loop()
+        finally:
+            self._biasReception.stop_session()
+            # The graphs left in the queue are drawn before the thread ends
+            self._graphQueue.close()
+            self._graphThread.join()
+            if self._biasRecorder is not None:
+                self._biasRecorder.close()
+
+    def _app_loop(self):
+        # Receive the most recent n samples every hop samples (each window records how long every stage takes)
+        for window in self._biasReception.iter_windows(window=self._n, hop=self._hop, channels=self._number_of_channels,
+                                                       latest_only=self._latest_only):
+            # Apply digital filtering
+            with window.stage("filtering"):
+                filtered_data = self._biasFilter.filter_signals(window)
+
+            # Process data
+            with window.stage("band_processing"):
+                times, eeg_signals = self._biasProcessing.process_signals(filtered_data)
+
+            # Decide only with a trained model (and move only if actuation is enabled)
+            if self._biasAI.ai_is_trained():
+                with window.stage("features"):
+                    features = self._biasAI.extract_features(eeg_signals)
+                with window.stage("inference"):
+                    command = self._biasAI.predict_features(features)
+                if self._actuate:
+                    with window.stage("actuation"):
+                        self._biasMotor.move_if_possible(command)
+
+            self._biasLatency.record(window)
+
+            # Send the signals to the graphing thread (dropped if it is behind, depending on the policy)
+            # The raw signals are views of the reception buffer, so they are copied before leaving this thread
+            raw_signals = {ch: np.array(signal) for ch, signal in window.items()}
+            self._graphQueue.put((raw_signals, filtered_data, times, eeg_signals))
+
+    def _graph_loop(self):
         while True:
-            # Receive eeg data
-            signals = self._biasReception.get_real_data(channels=self._number_of_channels, n=self._n)
-            
+            item = self._graphQueue.get()
+            if item is None:
+                # Queue closed and empty
+                break
+            signals, filtered_data, times, eeg_signals = item
+
             # Graph signals
             for ch, signal in signals.items():
                 t = np.arange(len(signals[ch])) / self._fs
-                self._biasGraphing.graph_signal_voltage_time(t=t, signal=np.array(signal), title="Signal {}".format(ch))
+                self._biasGraphing.graph_signal_voltage_time(t=t, signal=np.asarray(signal), title="Signal {}".format(ch))
 
-            # Apply digital filtering
-            filtered_data = self._biasFilter.filter_signals(signals)
-
-            # Calculate the time vector
-            t = np.linspace(0, self._duration, self._n, endpoint=False)
+            # Calculate the time vector (of the filtered signals, which may be decimated)
+            t = np.linspace(0, self._duration, self._biasFilter.get_output_n(), endpoint=False)
             
             # Graph signals
             for ch, signal in filtered_data.items():
                 # Graph filtered signal
                 self._biasGraphing.graph_signal_voltage_time(t=t, signal=signal, title="Filtered Signal {}".format(ch))
 
-            # Process data
-            times, eeg_signals = self._biasProcessing.process_signals(filtered_data)
+            # Graph the spectrum of the filtered signals (the rfft of the band processing, not computed again)
+            self._biasProcessing.graph_spectra(eeg_signals, self._biasGraphing)
 
             # Plot 4 signals with its resepctive bands
             for ch, signals in eeg_signals.items():
-                # Plot the interpolated signals
+                # Plot the band signals
                 for band_name, sig in signals.items():
-                    self._biasGraphing.graph_signal_voltage_time(t=times[ch], signal=sig, title=f"{band_name.capitalize()} interpolated. {ch}")
+                    self._biasGraphing.graph_signal_voltage_time(t=times[ch], signal=sig, title=f"{band_name.capitalize()} band. {ch}")
             
             # Plot
             self._biasGraphing.plot_now()
-
-            #command = self._biasAI.predict_command(eeg_data=eeg_signals)
-            #self._biasMotor.move_if_possible(command)
\ No newline at end of file
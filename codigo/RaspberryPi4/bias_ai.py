@@ -7,6 +7,7 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 from bias_reception import ReceptionBias
 from bias_dsp import FilterBias, ProcessingBias
+from bias_spectral import get_spectral_plan
 from scipy.signal import welch
 from scipy.stats import skew, kurtosis, entropy
 from scipy.signal import cwt, morlet
@@ -24,9 +25,9 @@ def main():
     timeout = 1
     biasReception = ReceptionBias(port, baudrate, timeout)
     biasFilter = FilterBias(n=n, fs=fs, notch=True, bandpass=True, fir=False, iir=False)
-    biasProcessing = ProcessingBias(n=n, fs=fs)
+    biasProcessing = ProcessingBias(n=n, fs=fs, filter_instance=biasFilter)
     commands = ["forward", "backwards", "left", "right", "stop", "rest"]
-    biasAI = AIBias(n=n, fs=fs, channels=number_of_channels, commands=commands)
+    biasAI = AIBias(n=n, fs=fs, channels=number_of_channels, commands=commands, processing_instance=biasProcessing)
     train = input("Do you want to train model? (y/n): ")
     if train.lower() == "y":
         saved_dataset_path = None
@@ -52,9 +53,17 @@ def main():
 
 
 class AIBias:
-    def __init__(self, n, fs, channels, commands):
+    # n and fs are the ones of the acquisition, the features use the rate of the band signals given by
+    # processing_instance (or of the filtered signals given by filter_instance)
+    def __init__(self, n, fs, channels, commands, filter_instance=None, processing_instance=None):
         self._n = n
         self._fs = fs
+        if processing_instance is not None:
+            self._signals_fs = processing_instance.get_output_fs()
+        elif filter_instance is not None:
+            self._signals_fs = filter_instance.get_output_fs()
+        else:
+            self._signals_fs = fs
         self._number_of_channels = channels
         self._features_length = len(["mean", "variance", "skewness", "kurt", "energy",
                                  "band_power", "wavelet_energy", "entropy"])
@@ -156,7 +165,7 @@ class AIBias:
             assert(len(signals_per_channel) == self._number_of_waves_per_channel)
             # Iterate over the signals of each channel
             for band_name, signal_wave in signals_per_channel.items():
-                signal_wave = np.array(signal_wave)
+                signal_wave = np.asarray(signal_wave)
 
                 # Statistical Features
                 mean = np.mean(signal_wave)
@@ -165,8 +174,10 @@ class AIBias:
                 kurt = kurtosis(signal_wave)
                 energy = np.sum(signal_wave ** 2)
 
-                # Frequency Domain Features (Power Spectral Density)
-                freqs, psd = welch(signal_wave, fs=self._fs)  # Assuming fs = 500 Hz
+                # Frequency Domain Features (Power Spectral Density), segments of 256 samples with the shared hann window
+                segment_plan = get_spectral_plan(min(256, len(signal_wave)), self._signals_fs)
+                freqs, psd = welch(signal_wave, fs=self._signals_fs, window=segment_plan.window('hann'),
+                                   nperseg=segment_plan.n())
 
                 # Band Power
                 band_power = np.sum(psd)  # Total power within this band
@@ -213,7 +224,13 @@ class AIBias:
         
         # Extract features from the EEG data
         features = self.extract_features(eeg_data)
-        
+        return self.predict_features(features)
+
+    # Predict the command of features already extracted (so features and inference can be timed apart)
+    def predict_features(self, features):
+        if not self._is_trained:
+            raise Exception("Model has not been trained yet.")
+
         # Ensure the features have the correct shape (1, number_of_channels, number_of_features)
         features = features.reshape(1, self._number_of_channels, self._num_features_per_channel)
         
@@ -0,0 +1,295 @@
+import time
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+class RingBufferBias:
+    # Constructor
+    def __init__(self, channels, capacity, dtype=np.float32):
+        self._channels = channels
+        self._capacity = capacity
+        self._dtype = np.dtype(dtype)
+
+        # The storage is mirrored (each sample is written at i and i + capacity),
+        # so any window of up to capacity samples is a contiguous slice and can
+        # be handed to consumers as a view without copying
+        self._storage = np.zeros((channels, 2 * capacity), dtype=self._dtype)
+
+        # Absolute sample counters (they never wrap)
+        self._write_index = 0
+        self._read_index = 0
+        self._overrun_samples = 0
+
+        # Used to wait for new samples from another thread
+        self._condition = threading.Condition()
+
+    # Define getters
+    def channels(self):
+        return self._channels
+
+    def capacity(self):
+        return self._capacity
+
+    def dtype(self):
+        return self._dtype
+
+    def total_written(self):
+        return self._write_index
+
+    def overrun_samples(self):
+        return self._overrun_samples
+
+    # Check if other processes read the buffer (then available() and overrun_samples() only describe this process)
+    def is_shared(self):
+        return False
+
+    # Number of samples written but not read yet
+    def available(self):
+        with self._condition:
+            return self._write_index - self._read_index
+
+    # Write a channels x samples block at the end of the buffer
+    def write(self, block):
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block.reshape(self._channels, -1)
+        if block.shape[0] != self._channels:
+            raise ValueError(f"Expected {self._channels} channels, got {block.shape[0]}")
+
+        # Only the newest samples fit if the block is bigger than the buffer
+        samples = block.shape[1]
+        skipped = max(0, samples - self._capacity)
+        block = block[:, skipped:]
+
+        with self._condition:
+            self._copy_in(block, self._write_index + skipped)
+            self._write_index += samples
+
+            # Drop the oldest unread samples if the writer overtook the reader
+            unread = self._write_index - self._read_index
+            if unread > self._capacity:
+                self._overrun_samples += unread - self._capacity
+                self._read_index = self._write_index - self._capacity
+
+            self._condition.notify_all()
+
+    def _copy_in(self, block, start_index):
+        samples = block.shape[1]
+        start = start_index % self._capacity
+        if samples == 0:
+            return
+        # Split the block where it wraps and write both copies of each part
+        first = min(samples, self._capacity - start)
+        self._storage[:, start:start + first] = block[:, :first]
+        self._storage[:, start + self._capacity:start + self._capacity + first] = block[:, :first]
+        if first < samples:
+            rest = samples - first
+            self._storage[:, :rest] = block[:, first:]
+            self._storage[:, self._capacity:self._capacity + rest] = block[:, first:]
+
+    # View of the samples between two absolute indexes
+    def _view(self, start, stop):
+        offset = start % self._capacity
+        return self._storage[:, offset:offset + (stop - start)]
+
+    # Block until n unread samples are available (or the timeout expires)
+    # (running_event lets a producer that stops cancel the wait)
+    def wait_for_samples(self, n, timeout=None, running_event=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self._write_index - self._read_index >= n
+                                     or (running_event is not None and not running_event.is_set()),
+                                     timeout=timeout)
+            return self._write_index - self._read_index >= n
+
+    # Number of samples that can be written without overwriting unread ones
+    def free_space(self):
+        with self._condition:
+            return self._capacity - (self._write_index - self._read_index)
+
+    # Block until n samples can be written without overwriting unread ones
+    # (used by producers faster than real time, which must not drop samples)
+    def wait_for_space(self, n, timeout=None, running_event=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self._capacity - (self._write_index - self._read_index) >= n
+                                     or (running_event is not None and not running_event.is_set()),
+                                     timeout=timeout)
+            return self._capacity - (self._write_index - self._read_index) >= n
+
+    # Wake up every consumer waiting on the buffer
+    def notify_all(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    # Look at the next n unread samples without consuming them
+    def peek(self, n):
+        with self._condition:
+            if n > self._write_index - self._read_index:
+                raise ValueError(f"Only {self._write_index - self._read_index} samples available, requested {n}")
+            return self._view(self._read_index, self._read_index + n)
+
+    # Consume n samples
+    def advance(self, n):
+        with self._condition:
+            self._read_index = min(self._read_index + n, self._write_index)
+            self._condition.notify_all()
+
+    # Take the next n unread samples (the returned view is valid until the
+    # writer wraps around it, copy it if it has to live longer)
+    def read(self, n):
+        with self._condition:
+            view = self.peek(n)
+            self._read_index += n
+            self._condition.notify_all()
+            return view
+
+    # The newest n samples, regardless of what has been read
+    def latest(self, n):
+        with self._condition:
+            n = min(n, self._write_index, self._capacity)
+            return self._view(self._write_index - n, self._write_index)
+
+    # Forget every sample written so far
+    def clear(self):
+        with self._condition:
+            self._read_index = self._write_index
+            self._condition.notify_all()
+
+# Header of the shared memory block: int64 slots followed by the dtype string
+SHARED_WRITE_INDEX = 0
+SHARED_CHANNELS = 1
+SHARED_CAPACITY = 2
+SHARED_RESERVED_INDEX = 3
+SHARED_HEADER_SLOTS = 8
+SHARED_DTYPE_BYTES = 16
+SHARED_HEADER_BYTES = 128
+
+# Ring buffer in shared memory: one process writes and any number of processes attach to read it.
+# The writer publishes the index it is about to write up to (reserved index) before copying a block
+# and the write index after it. Each reader keeps its own read index and checks with the reserved
+# index that the writer didn't overwrite what it copied, so no locks are shared between processes.
+# available() and overrun_samples() are the ones of the reader of this process
+class SharedRingBufferBias(RingBufferBias):
+    # Constructor
+    # With create=True a new block is made (channels and capacity are needed), otherwise it attaches to `name`
+    def __init__(self, name=None, channels=None, capacity=None, dtype=np.float32, create=False, poll_interval=0.001):
+        if create:
+            dtype = np.dtype(dtype)
+            size = SHARED_HEADER_BYTES + channels * 2 * capacity * dtype.itemsize
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._header = np.ndarray((SHARED_HEADER_SLOTS,), dtype=np.int64, buffer=self._shm.buf)
+            self._header[:] = 0
+            self._header[SHARED_CHANNELS] = channels
+            self._header[SHARED_CAPACITY] = capacity
+            self._shm.buf[SHARED_HEADER_SLOTS * 8:SHARED_HEADER_SLOTS * 8 + SHARED_DTYPE_BYTES] = \
+                dtype.str.encode().ljust(SHARED_DTYPE_BYTES, b'\0')
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._header = np.ndarray((SHARED_HEADER_SLOTS,), dtype=np.int64, buffer=self._shm.buf)
+            dtype = np.dtype(bytes(self._shm.buf[SHARED_HEADER_SLOTS * 8:SHARED_HEADER_SLOTS * 8 + SHARED_DTYPE_BYTES])
+                             .rstrip(b'\0').decode())
+
+        self._owner = create
+        self._channels = int(self._header[SHARED_CHANNELS])
+        self._capacity = int(self._header[SHARED_CAPACITY])
+        self._dtype = dtype
+        self._poll_interval = poll_interval
+        self._storage = np.ndarray((self._channels, 2 * self._capacity), dtype=self._dtype, buffer=self._shm.buf,
+                                   offset=SHARED_HEADER_BYTES)
+
+        # Readers start at the newest sample
+        self._read_index = int(self._header[SHARED_WRITE_INDEX])
+        self._overrun_samples = 0
+        # Only wakes up threads of this process, other processes poll the write index
+        self._condition = threading.Condition()
+
+    # The write index lives in shared memory so every process sees it
+    @property
+    def _write_index(self):
+        return int(self._header[SHARED_WRITE_INDEX])
+
+    @_write_index.setter
+    def _write_index(self, value):
+        self._header[SHARED_WRITE_INDEX] = value
+
+    # Announce which samples are going to be overwritten before copying them
+    def _copy_in(self, block, start_index):
+        self._header[SHARED_RESERVED_INDEX] = start_index + block.shape[1]
+        super()._copy_in(block, start_index)
+
+    # Oldest sample that can still be read safely
+    def _oldest_index(self):
+        return int(self._header[SHARED_RESERVED_INDEX]) - self._capacity
+
+    # Skip what the writer already overwrote (or is overwriting), counted as overrun
+    def _skip_overwritten(self):
+        oldest_index = self._oldest_index()
+        if self._read_index < oldest_index:
+            self._overrun_samples += oldest_index - self._read_index
+            self._read_index = oldest_index
+
+    # Define getter of the name other processes use to attach
+    def name(self):
+        return self._shm.name
+
+    # Every process reads with its own read index
+    def is_shared(self):
+        return True
+
+    # Number of unread samples that can still be read (the overwritten ones are skipped first)
+    def available(self):
+        with self._condition:
+            self._skip_overwritten()
+            return min(self._write_index - self._read_index, self._capacity)
+
+    # Block until n unread samples are available, polling the shared write index
+    def wait_for_samples(self, n, timeout=None, running_event=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._write_index - self._read_index < n:
+            if running_event is not None and not running_event.is_set():
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self._poll_interval)
+        return True
+
+    # The writer never waits for the readers, slow readers lose the oldest samples
+    def free_space(self):
+        return self._capacity
+
+    def wait_for_space(self, n, timeout=None, running_event=None):
+        return True
+
+    # Next n unread samples, copied and checked against the writer
+    def peek(self, n):
+        while True:
+            write_index = self._write_index
+            self._skip_overwritten()
+            if n > write_index - self._read_index:
+                raise ValueError(f"Only {write_index - self._read_index} samples available, requested {n}")
+
+            block = self._view(self._read_index, self._read_index + n).copy()
+            # The copy is valid if the writer didn't reach those samples meanwhile
+            if self._oldest_index() <= self._read_index:
+                return block
+
+    def read(self, n):
+        block = self.peek(n)
+        self._read_index += n
+        return block
+
+    # Newest n samples, copied and checked against the writer
+    def latest(self, n):
+        while True:
+            write_index = self._write_index
+            start_index = write_index - min(n, write_index - max(self._oldest_index(), 0))
+            block = self._view(start_index, write_index).copy()
+            if self._oldest_index() <= start_index:
+                return block
+
+    # Detach from the shared memory (the creator also frees it)
+    def close(self):
+        self._storage = None
+        self._header = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,57 @@
+import collections
+import numpy as np
+
+# Maps the clock of a board (timestamps of its frames) to the monotonic clock of the host
+class ClockSyncBias:
+    # Constructor
+    # history is the number of (board time, host time) pairs used to estimate the drift
+    def __init__(self, tick_hz=1000000, history=256):
+        self._tick_hz = tick_hz
+        self._history = history
+        self.reset()
+
+    # Forget the pairs and the estimated mapping
+    def reset(self):
+        self._pairs = collections.deque(maxlen=self._history)
+        self._last_ticks = None
+        self._wraps = 0
+        # host_time = intercept + slope * device_time (replaced as a whole, so other threads read a consistent pair)
+        self._fit = None
+
+    # Define getters
+    def is_synchronized(self):
+        return self._fit is not None
+
+    # Difference between the host and the board clock rates in parts per million (negative if the board clock is fast)
+    def drift_ppm(self):
+        return (self._fit[1] - 1) * 1e6 if self._fit is not None else 0.0
+
+    # Seconds of the board clock of a 32-bit tick counter, which wraps around
+    def unwrap(self, ticks):
+        if self._last_ticks is not None and ticks < self._last_ticks and self._last_ticks - ticks > 0x80000000:
+            self._wraps += 1
+        self._last_ticks = ticks
+        return (self._wraps * 0x100000000 + ticks) / self._tick_hz
+
+    # Add the host time at which a board time was seen and estimate the mapping again
+    def update(self, device_time, host_time):
+        self._pairs.append((device_time, host_time))
+        pairs = np.array(self._pairs)
+        device_times = pairs[:, 0] - pairs[0, 0]
+        host_times = pairs[:, 1] - pairs[0, 1]
+        if len(pairs) > 1 and device_times[-1] > 0:
+            slope = np.polyfit(device_times, host_times, 1)[0]
+        else:
+            slope = 1.0
+        # The transport only adds delay, so the line goes under every pair (lowest latency seen)
+        intercept = np.min(host_times - slope * device_times) + pairs[0, 1] - slope * pairs[0, 0]
+        self._fit = (intercept, slope)
+
+    # Convert between board and host time
+    def to_host(self, device_time):
+        intercept, slope = self._fit
+        return intercept + slope * device_time
+
+    def to_device(self, host_time):
+        intercept, slope = self._fit
+        return (host_time - intercept) / slope
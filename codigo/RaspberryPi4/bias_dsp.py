@@ -1,11 +1,15 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import scipy.interpolate
 import mne
-from scipy.signal import butter, filtfilt, firwin, lfilter, iirfilter
+import functools
+import collections.abc
+from scipy.signal import (butter, firwin, lfilter, iirfilter, sosfiltfilt, sosfilt, sosfilt_zi, lfilter_zi, group_delay,
+                          oaconvolve, resample_poly, upfirdn)
+import time
 import matplotlib.pyplot as plt
 from bias_reception import ReceptionBias
 from bias_graphing import GraphingBias
+from bias_spectral import EEG_BANDS, get_spectral_plan
 
 def main():
     n = 1000
@@ -22,7 +26,7 @@ def main():
     biasGraphing = GraphingBias(graph_in_terminal=False)
     for ch, signal in signals.items():
         t = np.arange(len(signals[ch])) / fs
-        biasGraphing.graph_signal_voltage_time(t=t, signal=np.array(signal), title="Signal {}".format(ch))
+        biasGraphing.graph_signal_voltage_time(t=t, signal=np.asarray(signal), title="Signal {}".format(ch))
 
     biasFilter = FilterBias(n=n, fs=fs, notch=True, bandpass=True, fir=True, iir=True)
 
@@ -30,14 +34,14 @@ def main():
     filtered_data = biasFilter.filter_signals(signals)
 
     # Calculate the time vector
-    t = np.linspace(0, duration, n, endpoint=False)
+    t = np.linspace(0, duration, biasFilter.get_output_n(), endpoint=False)
 
     for ch, signal in filtered_data.items():
         # Graph filtered signal
         biasGraphing.graph_signal_voltage_time(t=t, signal=signal, title="Filtered Signal {}".format(ch))
 
     # Process data
-    biasProcessing = ProcessingBias(n=n, fs=fs)
+    biasProcessing = ProcessingBias(n=n, fs=fs, filter_instance=biasFilter, graph=True)
     signals = biasProcessing.process_signals(eeg_signals=filtered_data)
 
     # Plot
@@ -53,27 +57,47 @@ class DSPBias:
 # Process signals
 class ProcessingBias(DSPBias):
     # Constructor
-    def __init__(self, n, fs):
+    # With filter_instance, n and fs are the ones of the filtered signals (they change if the filter decimates)
+    # upsampling multiplies the samples of the band signals (1, no upsampling, is what the decisions need)
+    # graph draws every input signal and its spectrum while processing (too slow for the decision loop, which sends
+    # them to graph_spectra from its graphing thread)
+    def __init__(self, n, fs, filter_instance=None, upsampling=1, graph=False):
+        if filter_instance is not None:
+            n, fs = filter_instance.get_output_n(), filter_instance.get_output_fs()
+        if upsampling < 1:
+            raise ValueError("upsampling must be a positive integer")
         super().__init__(n, fs)
-        self._biasGraphing = GraphingBias(graph_in_terminal=False)
+        self._upsampling = int(upsampling)
+        self._biasGraphing = GraphingBias(graph_in_terminal=False) if graph else None
+
+    # Define getters
+    def get_upsampling(self):
+        return self._upsampling
+
+    # Sampling frequency of the band signals
+    def get_output_fs(self):
+        return self._fs * self._upsampling
 
     # Process all the data
     def process_signals(self, eeg_signals):
-        processed_signals = {}
-        times = {}
-
-        # Process each signal in each channel for processing
-        for ch, signal in eeg_signals.items():
-            t, processed_signal = self.preprocess_signal(np.array(signal), ch)
-            processed_signals[ch] = processed_signal
-            times[ch] = t
-            
-        return times, processed_signals
+        channels = list(eeg_signals.keys())
+        signals = [eeg_signals[ch] for ch in channels]
+        if any(isinstance(signal, mne.epochs.Epochs) for signal in signals) or \
+                len({np.shape(signal) for signal in signals}) > 1:
+            # Epochs and channels of different lengths are processed one by one
+            times = {}
+            processed_signals = {}
+            for ch, signal in zip(channels, signals):
+                times[ch], processed_signals[ch] = self.preprocess_signal(signal, ch)
+            return times, processed_signals
+
+        # Every channel at once
+        return self.preprocess_block(np.stack([np.asarray(signal) for signal in signals]), channels)
 
     # Process one signal in particular
     def preprocess_signal(self, eeg_signal, channel_number):
         # Time vector
-        t = np.linspace(0, self._duration, self._n, endpoint=False)
+        t = get_spectral_plan(self._n, self._fs).times()
 
         # Check that eeg_signal is a numpy array
         if isinstance(eeg_signal, np.ndarray):
@@ -81,131 +105,544 @@ class ProcessingBias(DSPBias):
             signal = eeg_signal
         elif isinstance(eeg_signal, mne.epochs.Epochs):
             signal = eeg_signal.get_data(copy=True).mean(axis=0)  # Average over epochs
-            t = np.linspace(0, self._duration, len(signal), endpoint=False)
+            t = get_spectral_plan(len(signal), self._fs).times()
         else:
             raise ValueError("Unsupported data format")
 
-        # Make Fourier transform
-        signal_fft, frequencies, signal_fft_magnitude = self.do_fft(signal)
-
-        # Eliminate the range of negative frequencies for original signal
-        signal_fft_reduced = signal_fft[:self._n//2]
-        frequencies_reduced = frequencies[:self._n//2]
-        signal_fft_magnitude_reduced = signal_fft_magnitude[:self._n//2]
-
-        # Graph signal in frequency and in time domain
-        self._biasGraphing.graph_signal_voltage_time(t=t, signal=signal, title=f"Input signal {channel_number}")
-        self._biasGraphing.graph_signal_voltage_frequency(frequencies=frequencies_reduced, magnitudes=signal_fft_magnitude_reduced, title=f'Frequency spectrum of signal of {channel_number}')
-
-        # EEG bands
-        bands = {
-            "alpha": (8, 13),
-            "beta": (13, 30),
-            "gamma": (30, 100),
-            "delta": (0.5, 4),
-            "theta": (4, 8)
-        }
-
-        filtered_signals = {}
-        
-        # Reconstruct the negative part of signals
-        for band_name, band_range in bands.items():
-            # Reconstruct and then apply Fourier in order to get the five signals over time
-            filtered_signals[band_name] = self.filter_and_reconstruct(signal_fft, frequencies, band_range)
-                
-        # New sampling rate for interpolation
-        new_fs = self._fs * 10
-        new_t = np.linspace(0, self._duration, int(self._duration * new_fs), endpoint=True)
-
-        # Interpolate each wave
-        interpolated_signals = {band_name: self.interpolate_signal(t, sig.real, new_t) for band_name, sig in filtered_signals.items()}
+        times, processed_signals = self.preprocess_block(signal[np.newaxis, :], [channel_number], t=t)
+        return times[channel_number], processed_signals[channel_number]
+
+    # Process a channels x samples block, channel_names are the keys of the result
+    def preprocess_block(self, block, channel_names, t=None):
+        n = block.shape[-1]
+        # Frequency grid, band masks and time vector of this window length
+        plan = get_spectral_plan(n, self._fs)
+        if t is None:
+            t = plan.times()
+
+        # One Fourier transform for every channel, the bands are only reconstructed when they are used
+        processed_signals = self.band_signals_of_block(block, channel_names)
+
+        if self._biasGraphing is not None:
+            # Graph signal in frequency and in time domain
+            for number, ch in enumerate(channel_names):
+                self._biasGraphing.graph_signal_voltage_time(t=t, signal=block[number], title=f"Input signal {ch}")
+            self.graph_spectra(processed_signals, self._biasGraphing)
 
         # Return time vector and the signals already processed
-        return new_t, interpolated_signals
-
-    def do_fft(self, signal):
-        # Apply Fourier Transform for the original signal
-        signal_fft = np.fft.fft(signal)
-        frequencies = np.fft.fftfreq(self._n, d=1/self._fs)
-        signal_fft_magnitude = np.abs(signal_fft) / self._n
-
-        return signal_fft, frequencies, signal_fft_magnitude
-
-    def filter_and_reconstruct(self, signal_fft, frequencies, band):
-        # Filter each band with the corresponding wave
-        filtered_fft = np.zeros_like(signal_fft)
-        band_indices = np.where((frequencies >= band[0]) & (frequencies <= band[1]))
-        filtered_fft[band_indices] = signal_fft[band_indices] 
-        # Reconstruct signal in the negative side
-        filtered_fft[-band_indices[0]] = signal_fft[-band_indices[0]]
-        # Apply inverse Fourier transform in order to obtain a signal in the time domain
-        filtered_signal = np.fft.ifft(filtered_fft)
-        return filtered_signal.real
-
-    def interpolate_signal(self, t, signal, new_t):
-        # Clip new_t to the range of t to avoid out-of-bounds values
-        new_t_clipped = np.clip(new_t, t.min(), t.max())
-
-        # Interpolate the signal to new time points
-        interpolated_signal = scipy.interpolate.interp1d(t, signal, kind='cubic')(new_t_clipped)
-        return interpolated_signal
+        new_t = processed_signals.get_times()
+        return {ch: new_t for ch in channel_names}, processed_signals
+
+    # Graph the spectrum of each channel, taken from the rfft kept by the band signals of process_signals
+    def graph_spectra(self, band_signals, biasGraphing):
+        plan = band_signals.get_plan()
+        n = plan.n()
+        # Positive range of frequencies
+        frequencies_reduced = plan.frequencies()[:n//2]
+        spectrum_magnitude_reduced = np.abs(band_signals.get_spectrum()[:, :n//2]) / n
+        for number, ch in enumerate(band_signals):
+            biasGraphing.graph_signal_voltage_frequency(frequencies=frequencies_reduced, magnitudes=spectrum_magnitude_reduced[number], title=f'Frequency spectrum of signal of {ch}')
+
+    # Bands x bins mask which keeps the bins of each band in the spectrum of n samples (shared spectral plan)
+    def band_mask(self, n):
+        return get_spectral_plan(n, self._fs).band_mask()
+
+    # Split channels x samples signals in every band with one rfft and one batched irfft
+    # With upsampling the inverse transform is zero-padded, which interpolates the band-limited signals exactly
+    # Returns the spectrum (channels x bins) and the band signals (channels x bands x samples * upsampling)
+    def decompose_bands(self, block, upsampling=1):
+        n = block.shape[-1]
+        spectrum = np.fft.rfft(block, axis=-1)
+        band_signals = np.fft.irfft(spectrum[..., np.newaxis, :] * self.band_mask(n), n=n * upsampling, axis=-1)
+        if upsampling > 1:
+            # Keep the amplitude (irfft divides by the new length)
+            band_signals *= upsampling
+        return spectrum, band_signals
+
+    # Bands of the signals of the dict API, {ch: {band: signal}} computed when they are used
+    def band_signals(self, eeg_signals):
+        channels = list(eeg_signals.keys())
+        return self.band_signals_of_block(np.stack([np.asarray(eeg_signals[ch]) for ch in channels]), channels)
+
+    # Lazy bands of a channels x samples block, only its rfft is computed now
+    def band_signals_of_block(self, block, channel_names):
+        n = block.shape[-1]
+        return BandSignalsBias(channel_names=channel_names, spectrum=np.fft.rfft(block, axis=-1),
+                               plan=get_spectral_plan(n, self._fs), upsampling=self._upsampling)
+
+# Bands of the channels of one window, {ch: {band: signal}} like a dict but computed on first access
+# It only keeps the spectrum of the window: each band is reconstructed (for every channel at once) the first time it is
+# read and remembered, so the bands nobody reads cost nothing
+class BandSignalsBias(collections.abc.Mapping):
+    # Constructor
+    # spectrum is the rfft (channels x bins) of the window and plan its SpectralPlanBias (length, rate and bands)
+    def __init__(self, channel_names, spectrum, plan, upsampling=1):
+        self._channels = {ch: number for number, ch in enumerate(channel_names)}
+        self._bands = {band_name: number for number, band_name in enumerate(plan.band_names())}
+        self._spectrum = spectrum
+        self._plan = plan
+        self._band_mask = plan.band_mask()
+        self._n = plan.n()
+        self._fs = plan.fs()
+        self._upsampling = upsampling
+        # Band name -> channels x samples, band power and other upsampling factors, filled when they are asked for
+        self._band_signals = {}
+        self._band_power = None
+        self._upsampled = {}
+
+    # Mapping of the channels, each channel is a mapping of its bands
+    def __getitem__(self, ch):
+        if ch not in self._channels:
+            raise KeyError(ch)
+        return ChannelBandsBias(self, ch)
+
+    def __iter__(self):
+        return iter(self._channels)
+
+    def __len__(self):
+        return len(self._channels)
+
+    # Define getters
+    def get_spectrum(self):
+        return self._spectrum
+
+    def get_fs(self):
+        return self._fs * self._upsampling
+
+    def get_plan(self):
+        return self._plan
+
+    def get_times(self):
+        if self._upsampling == 1:
+            return self._plan.times()
+        return get_spectral_plan(self._n * self._upsampling, self.get_fs(), self._plan.bands()).times()
+
+    def band_names(self):
+        return list(self._bands)
+
+    # Signal of a band for every channel (channels x samples)
+    def band(self, band_name):
+        if band_name not in self._band_signals:
+            mask = self._band_mask[self._bands[band_name]]
+            signals = np.fft.irfft(self._spectrum * mask, n=self._n * self._upsampling, axis=-1)
+            if self._upsampling > 1:
+                # Keep the amplitude (irfft divides by the new length)
+                signals *= self._upsampling
+            self._band_signals[band_name] = signals
+        return self._band_signals[band_name]
+
+    def band_signal(self, ch, band_name):
+        return self.band(band_name)[self._channels[ch]]
+
+    # Every band of every channel (channels x bands x samples)
+    def band_matrix(self):
+        return np.stack([self.band(band_name) for band_name in self._bands], axis=1)
+
+    # Mean power of each band of each channel (channels x bands), straight from the spectrum (Parseval)
+    def band_power(self):
+        if self._band_power is None:
+            # Every bin of the rfft but DC and Nyquist stands for a positive and a negative frequency
+            weights = np.full(self._spectrum.shape[-1], 2.0)
+            weights[0] = 1.0
+            if self._n % 2 == 0:
+                weights[-1] = 1.0
+            power = np.abs(self._spectrum) ** 2 * weights / self._n ** 2
+            self._band_power = power @ self._band_mask.T.astype(power.dtype)
+        return self._band_power
+
+    # {ch: {band: power}}
+    def band_powers(self):
+        band_power = self.band_power()
+        return {ch: {band_name: float(band_power[number, band_number]) for band_name, band_number in self._bands.items()}
+                for ch, number in self._channels.items()}
+
+    # Same bands with the samples multiplied by factor (interpolated from the spectrum)
+    def upsampled(self, factor):
+        if factor == self._upsampling:
+            return self
+        if factor not in self._upsampled:
+            self._upsampled[factor] = BandSignalsBias(channel_names=self._channels, spectrum=self._spectrum,
+                                                      plan=self._plan, upsampling=factor)
+        return self._upsampled[factor]
+
+# Bands of one channel of a BandSignalsBias, {band: signal}
+class ChannelBandsBias(collections.abc.Mapping):
+    # Constructor
+    def __init__(self, band_signals, ch):
+        self._band_signals = band_signals
+        self._ch = ch
+
+    def __getitem__(self, band_name):
+        if band_name not in self._band_signals.band_names():
+            raise KeyError(band_name)
+        return self._band_signals.band_signal(self._ch, band_name)
+
+    def __iter__(self):
+        return iter(self._band_signals.band_names())
+
+    def __len__(self):
+        return len(self._band_signals.band_names())
+
+# How a FIR filter is executed: direct convolution (lfilter), FFT overlap-add, or chosen from taps and block length
+FIR_MODES = ('auto', 'direct', 'fft')
+# In auto mode, filters with at least this many taps use the FFT on blocks of at least this many samples
+# (below them the setup of the FFT costs more than the direct convolution)
+FIR_FFT_MIN_TAPS = 256
+FIR_FFT_MIN_LENGTH = 256
+
+# Choose the FIR execution of a filter of numtaps on blocks of length samples
+def fir_method(numtaps, length, mode='auto'):
+    if mode not in FIR_MODES:
+        raise ValueError(f"Unsupported FIR mode {mode}")
+    if mode != 'auto':
+        return mode
+    return 'fft' if numtaps >= FIR_FFT_MIN_TAPS and length >= FIR_FFT_MIN_LENGTH else 'direct'
+
+# Causal FIR filter along the last axis, same result as lfilter(taps, 1.0, data, axis=-1, zi=state)
+# state holds what the previous samples still add to the next numtaps - 1 outputs, returns (y, new state)
+def fir_convolve(taps, data, state=None, mode='auto'):
+    length = data.shape[-1]
+    if fir_method(len(taps), length, mode) == 'direct':
+        if state is None:
+            return lfilter(taps, 1.0, data, axis=-1), None
+        return lfilter(taps, 1.0, data, axis=-1, zi=state)
+
+    # Overlap-add: the full convolution gives this block's output and the tail which overlaps the next block
+    full = oaconvolve(data, taps.reshape((1,) * (data.ndim - 1) + (-1,)), axes=-1)
+    if state is None:
+        return full[..., :length], None
+    y = full[..., :length].astype(np.float64)
+    tail = full[..., length:].astype(np.float64)
+    # Add what the previous blocks still had pending, the part beyond this block stays pending
+    overlap = min(length, state.shape[-1])
+    y[..., :overlap] += state[..., :overlap]
+    tail[..., :state.shape[-1] - overlap] += state[..., overlap:]
+    return y, tail
+
+# Time the FIR filter of each number of taps with direct and FFT convolution on blocks of each length
+# Returns one dict per combination with the seconds per block of each mode and the mode chosen by auto
+def benchmark_fir(fs=500, numtaps=(101, 401, 1601), lengths=(10, 125, 1000, 5000), channels=4, repeats=20):
+    results = []
+    for taps in numtaps:
+        coefficients = design_fir(fs, min(30, fs / 4), taps)
+        for length in lengths:
+            data = np.random.randn(channels, length).astype(np.float32)
+            result = {"numtaps": taps, "length": length, "auto": fir_method(taps, length)}
+            for mode in ("direct", "fft"):
+                start_time = time.perf_counter()
+                for _ in range(repeats):
+                    fir_convolve(coefficients, data, mode=mode)
+                result[mode] = (time.perf_counter() - start_time) / repeats
+            results.append(result)
+    return results
+
+# Print the results of benchmark_fir as a table in milliseconds
+def print_fir_benchmark(results):
+    print(f"{'taps':>6}{'samples':>9}{'direct':>10}{'fft':>10}  auto  [ms]")
+    for result in results:
+        print(f"{result['numtaps']:>6}{result['length']:>9}{result['direct'] * 1000:>10.3f}{result['fft'] * 1000:>10.3f}"
+              f"  {result['auto']}")
+
+# Second-order sections of each filter, designed once per configuration and shared by every FilterBias
+# (the returned arrays are cached, they must not be modified)
+@functools.lru_cache(maxsize=None)
+def design_notch_sos(fs, notch_freq, quality_factor=30):
+    # Specific small band which will be filtered around the notch frequency
+    nyquist = 0.5 * fs
+    notch = notch_freq / nyquist
+    return butter(2, [notch - notch / quality_factor, notch + notch / quality_factor], btype='bandstop', output='sos')
+
+@functools.lru_cache(maxsize=None)
+def design_bandpass_sos(fs, lowcut, highcut, order=5):
+    # Bandpass filter which allows a specific range of frequencies to pass
+    nyquist = 0.5 * fs
+    return butter(order, [lowcut / nyquist, highcut / nyquist], btype='band', output='sos')
+
+@functools.lru_cache(maxsize=None)
+def design_iir_sos(fs, cutoff, order=4):
+    # Low-pass IIR filter
+    return iirfilter(order, cutoff, fs=fs, btype='low', ftype='butter', output='sos')
+
+@functools.lru_cache(maxsize=None)
+def design_fir(fs, cutoff, numtaps):
+    # Low-pass FIR filter
+    return firwin(numtaps, cutoff, fs=fs, pass_zero=True)
+
+@functools.lru_cache(maxsize=None)
+def design_decimator(factor):
+    # Anti-aliasing low-pass FIR at the new Nyquist frequency (the same design resample_poly uses)
+    return firwin(20 * factor + 1, 1.0 / factor, window=('kaiser', 5.0))
+
+@functools.lru_cache(maxsize=None)
+def design_filter_bank(fs, notch=True, bandpass=True, fir=False, iir=False, notch_freq=50, quality_factor=30,
+                       lowcut=0.5, highcut=50, bandpass_order=5, fir_cutoff=30, fir_numtaps=101, iir_cutoff=30,
+                       iir_order=4, fir_mode='auto', decimation=1):
+    return FilterBankBias(fs=fs, notch=notch, bandpass=bandpass, fir=fir, iir=iir, notch_freq=notch_freq,
+                          quality_factor=quality_factor, lowcut=lowcut, highcut=highcut, bandpass_order=bandpass_order,
+                          fir_cutoff=fir_cutoff, fir_numtaps=fir_numtaps, iir_cutoff=iir_cutoff, iir_order=iir_order,
+                          fir_mode=fir_mode, decimation=decimation)
+
+# Every filter of FilterBias in one object: the notch, bandpass and IIR stages are concatenated in a single
+# cascade of second-order sections (applied forward and backward, zero phase) and the FIR stage is applied after it
+# Once the signals are band-limited they can be decimated by an integer factor with a polyphase filter
+class FilterBankBias:
+    # Constructor
+    def __init__(self, fs, notch=True, bandpass=True, fir=False, iir=False, notch_freq=50, quality_factor=30,
+                 lowcut=0.5, highcut=50, bandpass_order=5, fir_cutoff=30, fir_numtaps=101, iir_cutoff=30, iir_order=4,
+                 fir_mode='auto', decimation=1):
+        if fir_mode not in FIR_MODES:
+            raise ValueError(f"Unsupported FIR mode {fir_mode}")
+        if decimation < 1:
+            raise ValueError("decimation must be a positive integer")
+        self._fs = fs
+        self._fir_mode = fir_mode
+        self._decimation = decimation
+        self._decimator = design_decimator(decimation) if decimation > 1 else None
+        sections = []
+        if notch:
+            # Remove power line noise
+            sections.append(design_notch_sos(fs, notch_freq, quality_factor))
+        if bandpass:
+            # Apply high-pass and low-pass filters (bandpass)
+            sections.append(design_bandpass_sos(fs, lowcut, highcut, bandpass_order))
+        if iir:
+            sections.append(design_iir_sos(fs, iir_cutoff, iir_order))
+        self._sos = np.concatenate(sections) if sections else None
+        self._fir = design_fir(fs, fir_cutoff, fir_numtaps) if fir else None
+
+    # Define getters
+    def sos(self):
+        return self._sos
+
+    def fir(self):
+        return self._fir
+
+    def fir_mode(self):
+        return self._fir_mode
+
+    def decimation(self):
+        return self._decimation
+
+    # Sampling frequency and number of samples after the decimation
+    def output_fs(self):
+        return self._fs // self._decimation
+
+    def output_length(self, length):
+        return -(-length // self._decimation)
+
+    # Gain of the filters before the decimator for a constant signal
+    def dc_gain(self):
+        gain = 1.0
+        if self._sos is not None:
+            gain *= np.prod(self._sos[:, :3].sum(axis=1) / self._sos[:, 3:].sum(axis=1))
+        if self._fir is not None:
+            gain *= self._fir.sum()
+        return gain
+
+    # Shortest block which can be filtered forward and backward
+    def min_length(self):
+        if self._sos is None:
+            return 1
+        return 3 * (2 * len(self._sos) + 1 - min((self._sos[:, 2] == 0).sum(), (self._sos[:, 5] == 0).sum())) + 1
+
+    # Filter a channels x samples array along the samples
+    def apply(self, data):
+        y = data
+        if self._sos is not None:
+            if data.shape[-1] < self.min_length():
+                raise ValueError(f"The length of the input vector must be at least {self.min_length()}. Data length is {data.shape[-1]}.")
+            y = sosfiltfilt(self._sos, y, axis=-1)
+        if self._fir is not None:
+            # Causal FIR filter, direct or FFT overlap-add depending on the taps and the block length
+            y, _ = fir_convolve(self._fir, y, mode=self._fir_mode)
+        if self._decimator is not None:
+            # Keep one of every `decimation` samples, only the outputs which are kept are computed
+            y = resample_poly(y, 1, self._decimation, axis=-1, window=self._decimator, padtype='line')
+        # Keep the precision of the input (float32 from the reception) once the filtering is done in float64
+        if np.issubdtype(data.dtype, np.floating):
+            y = y.astype(data.dtype, copy=False)
+        return y
+
+    # State of the causal filters for a stream of channels, starting in steady state with the first sample of each channel
+    def initial_state(self, first_samples):
+        first_samples = np.asarray(first_samples, dtype=np.float64)
+        sos_state = None
+        fir_state = None
+        decimator_state = None
+        if self._sos is not None:
+            sos_state = sosfilt_zi(self._sos)[:, np.newaxis, :] * first_samples[np.newaxis, :, np.newaxis]
+        if self._fir is not None:
+            fir_state = lfilter_zi(self._fir, 1.0)[np.newaxis, :] * first_samples[:, np.newaxis]
+        if self._decimator is not None:
+            # Previous input samples of the decimator and position of the next sample kept
+            history = np.repeat(first_samples[:, np.newaxis] * self.dc_gain(), len(self._decimator) - 1, axis=1)
+            decimator_state = (history, 0)
+        return sos_state, fir_state, decimator_state
+
+    # Filter a channels x samples chunk of a stream causally (any length, even one sample), returns (y, new state)
+    def apply_causal(self, data, state):
+        sos_state, fir_state, decimator_state = state
+        y = data
+        if self._sos is not None:
+            y, sos_state = sosfilt(self._sos, y, axis=-1, zi=sos_state)
+        if self._fir is not None:
+            y, fir_state = fir_convolve(self._fir, y, state=fir_state, mode=self._fir_mode)
+        if self._decimator is not None:
+            y, decimator_state = self._decimate_causal(y, decimator_state)
+        if np.issubdtype(data.dtype, np.floating):
+            y = y.astype(data.dtype, copy=False)
+        return y, (sos_state, fir_state, decimator_state)
+
+    # Causal polyphase decimation of a chunk, the samples kept stay evenly spaced across chunks
+    def _decimate_causal(self, data, state):
+        history, phase = state
+        factor = self._decimation
+        length = data.shape[-1]
+        extended = np.concatenate([history, data], axis=-1)
+        # Samples of the chunk which are kept: phase, phase + factor, ...
+        kept = max(0, -(-(length - phase) // factor))
+        # Start the polyphase filter so its outputs fall on the samples kept
+        delay = len(self._decimator) - 1
+        start = (phase + delay) % factor
+        first = (phase + delay - start) // factor
+        y = upfirdn(self._decimator, extended[..., start:], up=1, down=factor, axis=-1)[..., first:first + kept]
+        return y, (extended[..., -delay:], (phase - length) % factor)
+
+    # Delay in seconds added by the causal filters at each frequency (the FIR has a linear phase, its delay is constant)
+    def group_delay(self, frequencies):
+        frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+        delay = np.zeros_like(frequencies)
+        if self._sos is not None:
+            for section in self._sos:
+                _, section_delay = group_delay((section[:3], section[3:]), w=frequencies, fs=self._fs)
+                delay += section_delay
+        if self._fir is not None:
+            delay += (len(self._fir) - 1) / 2
+        if self._decimator is not None:
+            delay += (len(self._decimator) - 1) / 2
+        return delay / self._fs
 
 class FilterBias(DSPBias):
     # Constructor
-    def __init__(self, n, fs, notch, bandpass, fir, iir):
+    def __init__(self, n, fs, notch, bandpass, fir, iir, notch_freq=50, quality_factor=30, lowcut=0.5, highcut=50,
+                 bandpass_order=5, fir_cutoff=30, fir_numtaps=101, iir_cutoff=30, iir_order=4, fir_mode='auto',
+                 decimate_to=None):
         self._notch = notch
         self._bandpass = bandpass
         self._fir = fir
         self._iir = iir
+        # Optional sampling frequency of the filtered signals (e.g. 125 Hz), it must divide fs
+        if decimate_to is not None and (decimate_to <= 0 or fs % decimate_to != 0):
+            raise ValueError(f"Can't decimate from {fs} Hz to {decimate_to} Hz, it must be an integer factor")
+        self._decimation = int(fs // decimate_to) if decimate_to is not None else 1
+        # Parameters of the filters, the filter bank is designed again only when one of them changes
+        self._parameters = dict(notch_freq=notch_freq, quality_factor=quality_factor, lowcut=lowcut, highcut=highcut,
+                                bandpass_order=bandpass_order, fir_cutoff=fir_cutoff, fir_numtaps=fir_numtaps,
+                                iir_cutoff=iir_cutoff, iir_order=iir_order, fir_mode=fir_mode)
+        self._filter_bank = None
+        self._filter_bank_key = None
+        # State of the streaming mode (filters of the bank carried from one chunk to the next)
+        self._stream_state = None
+        self._stream_key = None
         super().__init__(n=n, fs=fs)
 
-    # Filter all the signals
+    # Change parameters of the filters (e.g. set_parameters(lowcut=1, highcut=40))
+    def set_parameters(self, **parameters):
+        for name in parameters:
+            if name not in self._parameters:
+                raise ValueError(f"Unknown filter parameter {name}")
+        self._parameters.update(parameters)
+
+    def get_parameters(self):
+        return dict(self._parameters)
+
+    # Sampling frequency and samples per window of the filtered signals (the ones ProcessingBias and AIBias receive)
+    def get_output_fs(self):
+        return self._fs // self._decimation
+
+    def get_output_n(self):
+        return -(-self._n // self._decimation)
+
+    # Filter bank of the current configuration (designed only the first time it is used)
+    def get_filter_bank(self):
+        key = ((self._fs, self._notch, self._bandpass, self._fir, self._iir, self._decimation) +
+               tuple(sorted(self._parameters.items())))
+        if key != self._filter_bank_key:
+            self._filter_bank = design_filter_bank(self._fs, self._notch, self._bandpass, self._fir, self._iir,
+                                                   decimation=self._decimation, **self._parameters)
+            self._filter_bank_key = key
+        return self._filter_bank
+
+    # Forget the state of the stream, the next chunk starts a new one
+    def reset_stream(self):
+        self._stream_state = None
+        self._stream_key = None
+
+    # Filter the next chunk (channels x samples) of a continuous stream
+    # Unlike filter_signals the filters are causal and keep their state between chunks, so chunks can be as short as
+    # wanted (e.g. 20 ms) without transients at their boundaries, at the cost of the delay given by get_group_delay
+    def stream_block(self, block):
+        block = self.preprocess_data(data=np.asarray(block))
+        if block.ndim == 1:
+            block = block.reshape(1, -1)
+        if block.shape[-1] == 0:
+            return block
+        filter_bank = self.get_filter_bank()
+        key = (self._filter_bank_key, block.shape[0])
+        if self._stream_state is None or key != self._stream_key:
+            # First chunk, or the filters or the channels changed
+            self._stream_state = filter_bank.initial_state(block[:, 0])
+            self._stream_key = key
+        filtered_block, self._stream_state = filter_bank.apply_causal(block, self._stream_state)
+        return filtered_block
+
+    # Same as stream_block with the dict API ({'ch0': chunk, ...})
+    def stream_signals(self, eeg_signals):
+        channels = list(eeg_signals.keys())
+        filtered_block = self.stream_block(np.stack([np.asarray(eeg_signals[ch]) for ch in channels]))
+        return {ch: filtered_block[number] for number, ch in enumerate(channels)}
+
+    # Seconds the streaming mode delays a component of the given frequency (by default the center of the passband)
+    def get_group_delay(self, frequency=None):
+        if frequency is None:
+            frequency = (self._parameters['lowcut'] + self._parameters['highcut']) / 2
+        return float(self.get_filter_bank().group_delay(frequency)[0])
+
+    # Filter all the signals ({'ch0': signal, ...}), the channels are filtered together as one block
     def filter_signals(self, eeg_signals):
-        filtered_signals = {}
-        # Filter by signals in each channel
-        for ch, signal in eeg_signals.items():
-            filtered_signal = self.digital_filtering(eeg_data=signal)
-            filtered_signals[ch] = filtered_signal
-        return filtered_signals
+        channels = list(eeg_signals.keys())
+        signals = [np.asarray(eeg_signals[ch]) for ch in channels]
+        if len({signal.shape for signal in signals}) > 1:
+            # Channels of different lengths can't be stacked, filter them one by one
+            return {ch: self.digital_filtering(eeg_data=signal) for ch, signal in zip(channels, signals)}
+        try:
+            filtered_block = self.filter_block(np.stack(signals))
+        # Handle errors in the digital filtering
+        except Exception as e:
+            print(f"An error occurred during filtering: {e}")
+            return {ch: None for ch in channels}
+        # Each channel is a row of the filtered block (views, no copies)
+        return {ch: filtered_block[number] for number, ch in enumerate(channels)}
+
+    # Filter a channels x samples block (or a trials x channels x samples batch) along the samples
+    # Every channel and trial goes through each stage in a single call
+    def filter_block(self, block):
+        # Handle NaN and infinite values
+        block = self.preprocess_data(data=np.asarray(block))
+        if block.ndim == 1:
+            block = block.reshape(1, -1)
+        return self.get_filter_bank().apply(block)
 
     def digital_filtering(self, eeg_data):
         try:
-            # Handle NaN and infinite values
-            eeg_data = self.preprocess_data(data=eeg_data)
-
-            # Print data shape
-            print(f"Original data shape: {eeg_data.shape}")
-
-            # Check the dimensions of the eeg_data
-            if eeg_data.ndim == 1:
-                eeg_data = eeg_data.reshape(1, -1)
-            
-            if self._notch:
-                # Remove power line noise
-                eeg_data = self.butter_notch_filter(eeg_data, notch_freq=50)
-                print(f"Data shape after notch filter: {eeg_data.shape}")
-            
-            if self._bandpass:
-                # Apply high-pass and low-pass filters (bandpass)
-                eeg_data = self.butter_bandpass_filter(eeg_data, lowcut=0.5, highcut=50)
-                print(f"Data shape after bandpass filter: {eeg_data.shape}")
-            
-            if self._fir:
-                # Apply FIR filter
-                eeg_data = self.fir_filter(eeg_data, cutoff=30, numtaps=101)
-                print(f"Data shape after FIR filter: {eeg_data.shape}")
-            
-            if self._iir:
-                # Apply IIR filter
-                eeg_data = self.iir_filter(eeg_data, cutoff=30)
-                print(f"Data shape after IIR filter: {eeg_data.shape}")
-            
-            if eeg_data is not None:
-                # Ensure the filtered data has the same length as t
-                if eeg_data.shape[0] == 1:
-                    eeg_data = eeg_data.flatten()
-
-                return eeg_data
+            # Notch, bandpass, FIR and IIR filters in one pass
+            eeg_data = self.filter_block(eeg_data)
+
+            # Ensure the filtered data has the same length as t
+            if eeg_data.shape[0] == 1:
+                eeg_data = eeg_data.flatten()
+
+            return eeg_data
 
         # Handle errors in the digital filtering
         except Exception as e:
@@ -214,66 +651,27 @@ class FilterBias(DSPBias):
 
     # Preprocessing function to handle inf and NaN values
     def preprocess_data(self, data):
-        # Replace inf with NaN
-        data = np.where(np.isinf(data), np.nan, data)
-        # Remove NaN values
-        data = np.nan_to_num(data)
-        return data
+        # Replace NaN and inf with zeros in a single pass
+        return np.nan_to_num(data, nan=0.0, posinf=0.0, neginf=0.0)
 
     def butter_bandpass_filter(self, data, lowcut, highcut, order=5):
-        # Bandpass filter which allows a specific range of frequencies to pass
-        nyquist = 0.5 * self._fs
-        low = lowcut / nyquist
-        high = highcut / nyquist
-
-        # Range of the bandpass filter
-        b, a = butter(order, [low, high], btype='band')
-
-        # Check the padding length
-        padlen = 3 * max(len(b), len(a)) 
-        if data.shape[1] <= padlen:
-            raise ValueError(f"The length of the input vector must be greater than padlen, which is {padlen}. Data length is {data.shape[1]}.")
-        
-        # Apply the bandpass filter
-        y = filtfilt(b, a, data, axis=1)
-        return y
+        # Apply the bandpass filter (designed once for each cutoff)
+        sos = design_bandpass_sos(self._fs, lowcut, highcut, order)
+        return sosfiltfilt(sos, data, axis=-1)
 
     def butter_notch_filter(self, data, notch_freq, quality_factor=30):
-        # Filter used to remove a specific frequency
-        nyquist = 0.5 * self._fs
-        notch = notch_freq / nyquist
-
-        # Calculate the specific small band which will be filtered
-        b, a = butter(2, [notch - notch / quality_factor, notch + notch / quality_factor], btype='bandstop')
-
-        # Calculate the padding length
-        padlen = 3 * max(len(b), len(a))
-        if data.shape[1] <= padlen:
-            raise ValueError(f"The length of the input vector must be greater than padlen, which is {padlen}. Data length is {data.shape[1]}.")
-        
-        # Apply the notch filter
-        y = filtfilt(b, a, data, axis=1)
-        return y
+        # Apply the notch filter (designed once for each frequency)
+        sos = design_notch_sos(self._fs, notch_freq, quality_factor)
+        return sosfiltfilt(sos, data, axis=-1)
 
-    def fir_filter(self, data, cutoff, numtaps):
-        # Design FIR filter using firwin
-        fir_coefficients = firwin(numtaps, cutoff, fs=self._fs, pass_zero=True)  # Low-pass FIR filter
-        # Apply the FIR filter using lfilter
-        filtered_data = np.zeros_like(data)
-        for i in range(data.shape[0]):
-            filtered_data[i, :] = lfilter(fir_coefficients, 1.0, data[i, :])
-        
+    def fir_filter(self, data, cutoff, numtaps, mode='auto'):
+        # Apply the FIR filter to every channel at once
+        filtered_data, _ = fir_convolve(design_fir(self._fs, cutoff, numtaps), data, mode=mode)
         return filtered_data
 
     def iir_filter(self, data, cutoff):
-        # Design IIR filter using iirfilter
-        b, a = iirfilter(4, cutoff, fs=self._fs, btype='low', ftype='butter')  # Low-pass IIR filter
-        # Apply the IIR filter using filtfilt for zero-phase filtering
-        filtered_data = np.zeros_like(data)
-        for i in range(data.shape[0]):
-            filtered_data[i, :] = filtfilt(b, a, data[i, :])
-        
-        return filtered_data
+        # Apply the IIR filter using zero-phase filtering
+        return sosfiltfilt(design_iir_sos(self._fs, cutoff), data, axis=-1)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,77 +1,155 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import scipy.interpolate
-import mne
-from scipy.signal import butter, filtfilt, firwin, lfilter, iirfilter
-import threading  # Import threading
+import multiprocessing
 from bias_reception import ReceptionBias
 from bias_graphing import GraphingBias
 from bias_dsp import ProcessingBias, FilterBias
-from signals import random_signal
+from bias_buffer import SharedRingBufferBias
+from bias_spectral import SlidingBandPowerBias
 
 def main():
     n = 1000
     fs = 500
+    hop = 125
     number_of_channels = 4
-    duration = n / fs
-
-    # Initialize objects
-    biasReception = ReceptionBias()
-    biasGraphing = GraphingBias(graph_in_terminal=False)
+    buffer_capacity = 10 * n
+    # Dataset saved by AIBias.collect_and_train, the AI process only runs if there is one
+    saved_dataset_path = None
+
+    # Shared buffers: raw samples published by the reception and filtered samples published by the filter process
+    raw_bus = SharedRingBufferBias(channels=number_of_channels, capacity=buffer_capacity, create=True)
+    filtered_bus = SharedRingBufferBias(channels=number_of_channels, capacity=buffer_capacity, create=True)
+    stop_event = multiprocessing.Event()
+
+    # Each process attaches to the buses by name, samples are never pickled
+    processes = [
+        multiprocessing.Process(target=receive_data, name="ReceptionBias",
+                                args=(raw_bus.name(), number_of_channels, stop_event)),
+        multiprocessing.Process(target=filter_data, name="FilterBias",
+                                args=(raw_bus.name(), filtered_bus.name(), n, fs, stop_event)),
+        multiprocessing.Process(target=graph_data, name="GraphingBias",
+                                args=(filtered_bus.name(), n, fs, hop, stop_event)),
+        multiprocessing.Process(target=track_band_power, name="BandPowerBias",
+                                args=(filtered_bus.name(), fs, number_of_channels, stop_event)),
+    ]
+    if saved_dataset_path is not None:
+        processes.append(multiprocessing.Process(target=predict_data, name="AIBias",
+                                                 args=(filtered_bus.name(), n, fs, hop, number_of_channels,
+                                                       saved_dataset_path, stop_event)))
+
+    # Start every process
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ask every process to finish and wait for them
+        stop_event.set()
+        for process in processes:
+            process.join()
+    finally:
+        raw_bus.close()
+        filtered_bus.close()
+
+# Process which owns the serial port and publishes every sample in the raw bus
+def receive_data(raw_bus_name, number_of_channels, stop_event):
+    raw_bus = SharedRingBufferBias(name=raw_bus_name)
+    biasReception = ReceptionBias(buffer=raw_bus)
+    biasReception.start_session(channels=number_of_channels)
+    try:
+        while biasReception.session_is_running() and not stop_event.wait(0.5):
+            pass
+    finally:
+        biasReception.stop_session()
+        raw_bus.close()
+        # The other processes can't get more samples
+        stop_event.set()
+
+# Process which filters the raw bus as a stream and publishes the filtered samples
+# The filters keep their state between chunks, so every 20 ms of samples are filtered as soon as they arrive
+def filter_data(raw_bus_name, filtered_bus_name, n, fs, stop_event):
+    raw_bus = SharedRingBufferBias(name=raw_bus_name)
+    filtered_bus = SharedRingBufferBias(name=filtered_bus_name)
     biasFilter = FilterBias(n=n, fs=fs, notch=True, bandpass=True, fir=True, iir=True)
+    chunk = max(1, int(0.02 * fs))
+    print(f"Streaming filter delay: {biasFilter.get_group_delay() * 1000:.1f} ms")
+    try:
+        while not stop_event.is_set():
+            if not raw_bus.wait_for_samples(chunk, timeout=0.5):
+                continue
+            # Everything received so far, in one chunk
+            try:
+                filtered_bus.write(biasFilter.stream_block(raw_bus.read(raw_bus.available())))
+            except ValueError as e:
+                # The receiver overwrote the chunk while it was being read, the next one starts after the lost samples
+                print(f"Filtering fell behind: {e}")
+    finally:
+        # The rest of the processes can't go on without the filtered bus
+        stop_event.set()
+        raw_bus.close()
+        filtered_bus.close()
+
+# Process which graphs the newest filtered window every hop samples
+def graph_data(filtered_bus_name, n, fs, hop, stop_event):
+    filtered_bus = SharedRingBufferBias(name=filtered_bus_name)
+    biasGraphing = GraphingBias(graph_in_terminal=True)
+    try:
+        while not stop_event.is_set():
+            if not filtered_bus.wait_for_samples(hop, timeout=0.5):
+                continue
+            # Only the newest window matters, skip whatever couldn't be drawn in time
+            filtered_bus.advance(filtered_bus.available())
+            block = filtered_bus.latest(n)
+            t = np.arange(block.shape[1]) / fs
+            for ch in range(block.shape[0]):
+                biasGraphing.graph_signal_voltage_time(t=t, signal=block[ch], title="Filtered Signal ch{}".format(ch))
+    finally:
+        filtered_bus.close()
+
+# Process which tracks the band power of the filtered stream (20 values per second) and prints the newest every second
+def track_band_power(filtered_bus_name, fs, number_of_channels, stop_event, rate=20, report_interval=1.0):
+    filtered_bus = SharedRingBufferBias(name=filtered_bus_name)
+    biasBandPower = SlidingBandPowerBias(channels=number_of_channels, fs=fs, rate=rate)
+    next_report = report_interval
+    try:
+        while not stop_event.is_set():
+            if not filtered_bus.wait_for_samples(biasBandPower.hop(), timeout=0.5):
+                continue
+            # Only the frames completed by the new samples are computed
+            try:
+                biasBandPower.push(filtered_bus.read(filtered_bus.available()))
+            except ValueError as e:
+                # The filter overwrote the chunk while it was being read, the next one starts after the lost samples
+                print(f"Band power tracking fell behind: {e}")
+                continue
+            if biasBandPower.latest_time() is not None and biasBandPower.latest_time() >= next_report:
+                next_report = biasBandPower.latest_time() + report_interval
+                for ch, band_powers in biasBandPower.band_powers().items():
+                    print(f"{ch}: " + ", ".join(f"{band} {power:.2f}" for band, power in band_powers.items()))
+    finally:
+        stop_event.set()
+        filtered_bus.close()
+
+# Process which predicts a command for each filtered window
+def predict_data(filtered_bus_name, n, fs, hop, number_of_channels, saved_dataset_path, stop_event):
+    # TensorFlow is only loaded in this process
+    from bias_ai import AIBias
+    commands = ["forward", "backwards", "left", "right", "stop", "rest"]
+    filtered_bus = SharedRingBufferBias(name=filtered_bus_name)
     biasProcessing = ProcessingBias(n=n, fs=fs)
-
-    # Thread for receiving data
-    reception_thread = threading.Thread(target=receive_data, args=(biasReception, number_of_channels, n, biasGraphing, fs))
-
-    # Thread for filtering and processing data
-    processing_thread = threading.Thread(target=process_data, args=(biasReception, n, fs, biasFilter, biasProcessing, biasGraphing))
-
-    # Start both threads
-    reception_thread.start()
-    processing_thread.start()
-
-    # Wait for both threads to finish
-    reception_thread.join()
-    processing_thread.join()
-
-# Function to receive data
-def receive_data(biasReception, number_of_channels, n, biasGraphing, fs):
-    # Receive data from RP2040 Zero
-    signals = biasReception.get_real_data(channels=number_of_channels, n=n)
-    # Graph the signals
-    for ch, signal in signals.items():
-        t = np.arange(len(signals[ch])) / fs
-        biasGraphing.graph_signal_voltage_time(t=t, signal=np.array(signal), title="Signal {}".format(ch))
-
-# Function to process data (filter and further processing)
-def process_data(biasReception, n, fs, biasFilter, biasProcessing, biasGraphing):
-    # Receive data from RP2040 Zero
-    signals = biasReception.get_real_data(channels=4, n=n)
-
-    # Apply digital filtering
-    filtered_data = biasFilter.filter_signals(signals)
-
-    # Calculate the time vector
-    duration = n / fs
-    t = np.linspace(0, duration, n, endpoint=False)
-
-    # Graph filtered signals
-    for ch, signal in filtered_data.items():
-        biasGraphing.graph_signal_voltage_time(t=t, signal=signal, title="Filtered Signal {}".format(ch))
-
-    # Process filtered signals
-    times, processed_signals = biasProcessing.process_signals(filtered_data)
-
-    # Graph processed signals
-    for ch, signal in processed_signals.items():
-        biasGraphing.graph_signal_voltage_time(t=times[ch], signal=signal, title="Processed Signal {}".format(ch))
-
-    # Plot final graphs
-    biasGraphing.plot_now()
-
-# Classes remain unchanged
-# (DSPBias, ProcessingBias, FilterBias, etc.)
+    biasAI = AIBias(n=n, fs=fs, channels=number_of_channels, commands=commands)
+    biasAI.collect_and_train(reception_instance=None, filter_instance=None, processing_instance=biasProcessing,
+                             trials_per_command=1, saved_dataset_path=saved_dataset_path)
+    try:
+        while not stop_event.is_set():
+            if not filtered_bus.wait_for_samples(n, timeout=0.5):
+                continue
+            block = filtered_bus.peek(n)
+            _, eeg_signals = biasProcessing.process_signals({f'ch{ch}': block[ch] for ch in range(block.shape[0])})
+            print(f"Predicted Command: {biasAI.predict_command(eeg_data=eeg_signals)}")
+            filtered_bus.advance(hop)
+    finally:
+        filtered_bus.close()
 
 if __name__ == "__main__":
     main()
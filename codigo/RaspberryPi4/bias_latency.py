@@ -0,0 +1,102 @@
+import time
+import contextlib
+import collections
+import numpy as np
+
+# Order of the stages in the latency breakdown of a window (from the ADC to the motors)
+PIPELINE_STAGES = ["acquisition", "transport", "queue", "filtering", "band_processing", "features", "inference",
+                   "actuation"]
+
+# Window of signals ({'ch0': ..., ...}) which also carries when its samples were taken and what happened to it
+class WindowBias(dict):
+    # Constructor
+    # times is the 2 x samples array of the reception: host time of acquisition and host time of reception of each sample
+    def __init__(self, signals, times=None):
+        super().__init__(signals)
+        self.first_sample_time = float(times[0, 0]) if times is not None else None
+        self.last_sample_time = float(times[0, -1]) if times is not None else None
+        self.received_time = float(times[1, -1]) if times is not None else None
+        # Stage name -> [enter time, exit time] (host monotonic clock)
+        self.stages = {}
+
+    # Mark the beginning and the end of a stage
+    def enter(self, stage, now=None):
+        self.stages[stage] = [time.monotonic() if now is None else now, None]
+
+    def exit(self, stage, now=None):
+        self.stages[stage][1] = time.monotonic() if now is None else now
+
+    # Time a stage with a with block
+    @contextlib.contextmanager
+    def stage(self, stage):
+        self.enter(stage)
+        try:
+            yield self
+        finally:
+            self.exit(stage)
+
+    # Seconds spent in each part of the pipeline, from the first sample of the window to the last stage
+    def latency_breakdown(self):
+        breakdown = {}
+        finished = [(enter, exit) for enter, exit in self.stages.values() if exit is not None]
+        if self.last_sample_time is not None:
+            # Time to fill the window, time until the last sample reached the host and time waiting to be processed
+            breakdown["acquisition"] = self.last_sample_time - self.first_sample_time
+            breakdown["transport"] = self.received_time - self.last_sample_time
+            if finished:
+                breakdown["queue"] = min(enter for enter, _ in finished) - self.received_time
+        for stage, (enter, exit) in self.stages.items():
+            if exit is not None:
+                breakdown[stage] = exit - enter
+        # From the last sample acquired to the end of the last stage
+        if self.last_sample_time is not None and finished:
+            breakdown["total"] = max(exit for _, exit in finished) - self.last_sample_time
+        return breakdown
+
+# Collects the latency breakdown of the last windows and summarizes it per stage
+class LatencyTracerBias:
+    # Constructor
+    # callback receives the summary every `interval` windows
+    def __init__(self, history=1000, callback=None, interval=100):
+        self._history = history
+        self._callback = callback
+        self._interval = interval
+        self.reset()
+
+    # Forget every window
+    def reset(self):
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=self._history))
+        self._windows = 0
+
+    # Define getter
+    def number_of_windows(self):
+        return self._windows
+
+    # Save the breakdown of a processed window
+    def record(self, window):
+        for stage, seconds in window.latency_breakdown().items():
+            self._latencies[stage].append(seconds)
+        self._windows += 1
+        if self._callback is not None and self._windows % self._interval == 0:
+            self._callback(self.summary())
+
+    # Mean, median, 95th percentile and maximum seconds of each stage
+    def summary(self):
+        stages = [stage for stage in PIPELINE_STAGES if stage in self._latencies]
+        stages += [stage for stage in self._latencies if stage not in PIPELINE_STAGES]
+        summary = {}
+        for stage in stages:
+            latencies = np.array(self._latencies[stage])
+            summary[stage] = {
+                "mean": float(latencies.mean()),
+                "p50": float(np.percentile(latencies, 50)),
+                "p95": float(np.percentile(latencies, 95)),
+                "max": float(latencies.max()),
+            }
+        return summary
+
+# Print a summary as a table in milliseconds
+def print_latency_summary(summary):
+    print(f"{'stage':<16}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}  [ms]")
+    for stage, values in summary.items():
+        print(f"{stage:<16}" + "".join(f"{values[key] * 1000:>10.2f}" for key in ("mean", "p50", "p95", "max")))
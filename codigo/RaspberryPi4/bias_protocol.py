@@ -0,0 +1,270 @@
+import struct
+import json
+import binascii
+import numpy as np
+
+# Binary frame layout sent by reception.c (little-endian):
+# magic (2) | version (1) | channels (1) | sequence (4) | timestamp (4) | samples (2) | samples[channels][samples] (uint16) | crc16 (2)
+# The timestamp is the time of the first sample in microseconds of the board clock (version 1 frames don't have it)
+FRAME_MAGIC = b'\xb1\xa5'
+FRAME_VERSION = 2
+FRAME_PREFIX = struct.Struct('<2sB')
+FRAME_HEADERS = {1: struct.Struct('<2sBBIH'), 2: struct.Struct('<2sBBIIH')}
+FRAME_HEADER = FRAME_HEADERS[FRAME_VERSION]
+FRAME_CRC = struct.Struct('<H')
+SAMPLE_DTYPE = np.dtype('<u2')
+# Biggest frame accepted (the firmware sends 4 channels x 1000 samples, ~8 KB), a corrupted header which announces
+# more is rejected instead of waiting for its bytes
+MAX_FRAME_BYTES = 1 << 16
+# The firmware sends raw 12-bit ADC counts (3.3 V full scale)
+ADC_MV_PER_COUNT = 3.3 * 1000 / (1 << 12)
+ADC_MAX_COUNT = (1 << 12) - 1
+# The analog front end biases the signals at half of the ADC range
+ADC_MID_SCALE = 1 << 11
+
+class FrameBias:
+    # Constructor
+    def __init__(self, sequence, samples, timestamp=None):
+        self.sequence = sequence
+        # channels x samples uint16 array
+        self.samples = samples
+        # Board time of the first sample in microseconds (None if the board doesn't send it)
+        self.timestamp = timestamp
+
+# Converts raw ADC counts to float32 physical values (value = counts * gain + offset, per channel)
+class CalibrationBias:
+    # Constructor
+    # gain and offset are a value for every channel or a list with one per channel
+    def __init__(self, gain=ADC_MV_PER_COUNT, offset=0.0):
+        self._gain = np.atleast_1d(np.asarray(gain, dtype=np.float32))
+        self._offset = np.atleast_1d(np.asarray(offset, dtype=np.float32))
+
+    # Calibration which leaves the values as they are (sources already in physical units)
+    @classmethod
+    def identity(cls):
+        return cls(gain=1.0, offset=0.0)
+
+    # Define getters
+    def gain(self):
+        return self._gain
+
+    def offset(self):
+        return self._offset
+
+    # Convert a channels x samples block in one pass
+    def apply(self, samples):
+        channels = samples.shape[0]
+        values = samples.astype(np.float32)
+        values *= self._gain[:channels, None] if self._gain.size > 1 else self._gain
+        values += self._offset[:channels, None] if self._offset.size > 1 else self._offset
+        return values
+
+    # Values to store in a buffer of this dtype: integer buffers (raw storage) keep the counts, float ones get the
+    # physical values
+    def apply_for(self, samples, dtype):
+        if np.issubdtype(np.dtype(dtype), np.integer):
+            return samples
+        return self.apply(samples)
+
+    # Counts (float, not rounded) which apply() turns into these values: counts = (value - offset) / gain
+    def invert(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        channels = values.shape[0]
+        offset = self._offset[:channels, None] if self._offset.size > 1 else self._offset
+        gain = self._gain[:channels, None] if self._gain.size > 1 else self._gain
+        return (values - offset) / gain
+
+# Length of a complete frame in bytes
+def frame_length(channels, samples, version=FRAME_VERSION):
+    return FRAME_HEADERS[version].size + channels * samples * SAMPLE_DTYPE.itemsize + FRAME_CRC.size
+
+# CRC-16/CCITT-FALSE, the same one computed by the firmware
+def frame_crc(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+# Pack a channels x samples block in a binary frame
+def encode_frame(sequence, samples, timestamp=None, version=FRAME_VERSION):
+    samples = np.asarray(samples)
+    channels, number_of_samples = samples.shape
+    if version == 1:
+        header = FRAME_HEADERS[1].pack(FRAME_MAGIC, 1, channels, sequence & 0xFFFFFFFF, number_of_samples)
+    else:
+        header = FRAME_HEADERS[version].pack(FRAME_MAGIC, version, channels, sequence & 0xFFFFFFFF,
+                                             (timestamp or 0) & 0xFFFFFFFF, number_of_samples)
+    body = header + samples.astype(SAMPLE_DTYPE, copy=False).tobytes()
+    return body + FRAME_CRC.pack(frame_crc(body))
+
+# Read the version of a frame and check its magic bytes
+def decode_version(data, offset=0):
+    magic, version = FRAME_PREFIX.unpack_from(data, offset)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Frame doesn't start with the magic bytes")
+    if version not in FRAME_HEADERS:
+        raise ValueError(f"Unsupported frame version {version}")
+    return version
+
+# Read the header of a frame, returns (version, channels, sequence, timestamp, samples)
+def decode_header(data, offset=0):
+    version = decode_version(data, offset)
+    if version == 1:
+        _, _, channels, sequence, samples = FRAME_HEADERS[1].unpack_from(data, offset)
+        timestamp = None
+    else:
+        _, _, channels, sequence, timestamp, samples = FRAME_HEADERS[version].unpack_from(data, offset)
+    return version, channels, sequence, timestamp, samples
+
+# Decode a complete frame (header, samples and CRC)
+def decode_frame(data):
+    version, channels, sequence, timestamp, samples = decode_header(data)
+    length = frame_length(channels, samples, version)
+    if len(data) < length:
+        raise ValueError(f"Incomplete frame: {len(data)} of {length} bytes")
+
+    # Check the CRC before trusting the samples
+    crc_offset = length - FRAME_CRC.size
+    (crc,) = FRAME_CRC.unpack_from(data, crc_offset)
+    if crc != frame_crc(memoryview(data)[:crc_offset]):
+        raise ValueError(f"CRC mismatch in frame {sequence}")
+
+    # Samples are interpreted in place, without parsing
+    block = np.frombuffer(data, dtype=SAMPLE_DTYPE, count=channels * samples, offset=FRAME_HEADERS[version].size)
+    return FrameBias(sequence=sequence, samples=block.reshape(channels, samples), timestamp=timestamp)
+
+# Decode one JSON line sent by the firmware ({"ch0": [...], "ch1": [...], ...})
+# The samples are ADC counts, old firmware which sent floats (mV) is rejected instead of being taken as counts
+def decode_json(line):
+    json_data = json.loads(line)
+    values = np.array([json_data[f'ch{ch}'] for ch in range(len(json_data))])
+    if values.dtype.kind not in 'iu':
+        raise ValueError(f"JSON samples must be integer ADC counts, got {values.dtype}")
+    if values.size and (values.min() < 0 or values.max() > np.iinfo(SAMPLE_DTYPE).max):
+        raise ValueError("JSON samples out of the range of the ADC counts")
+    return FrameBias(sequence=None, samples=values.astype(SAMPLE_DTYPE))
+
+class StreamParserBias:
+    # Constructor
+    def __init__(self, protocol='auto', max_pending_bytes=1 << 20, max_frame_bytes=MAX_FRAME_BYTES):
+        if protocol not in ('json', 'binary', 'auto'):
+            raise ValueError(f"Unsupported protocol {protocol}")
+        self._protocol = protocol
+        # In auto mode the parser locks onto binary after the first valid binary frame, so the '{' bytes inside a
+        # corrupted binary frame aren't taken as JSON frames
+        self._active_protocol = protocol
+        self._max_pending_bytes = max_pending_bytes
+        self._max_frame_bytes = max_frame_bytes
+        # Bytes received but not parsed yet (partial tail of a frame)
+        self._pending = bytearray()
+        self._decode_failures = 0
+        self._resync_events = 0
+
+    # Define getters
+    def decode_failures(self):
+        return self._decode_failures
+
+    def resync_events(self):
+        return self._resync_events
+
+    def pending_bytes(self):
+        return len(self._pending)
+
+    # Protocol being parsed ('auto' until the first binary frame)
+    def active_protocol(self):
+        return self._active_protocol
+
+    # Forget any partial frame (the next stream can use any protocol again)
+    def reset(self):
+        self._pending.clear()
+        self._active_protocol = self._protocol
+
+    # Add the bytes of one read and return every complete frame found in them
+    def feed(self, data):
+        self._pending += data
+        frames = []
+        offset = 0
+        while True:
+            start = self._find_start(offset)
+            if start < 0:
+                # Nothing that looks like a frame, keep only a possible split magic
+                start = max(offset, len(self._pending) - (len(FRAME_MAGIC) - 1))
+            if start > offset:
+                # Bytes between frames are garbage, skip them
+                self._resync_events += 1
+                offset = start
+            if offset >= len(self._pending) or not self._is_start(offset):
+                break
+
+            if self._pending.startswith(FRAME_MAGIC, offset):
+                frame, consumed = self._parse_binary(offset)
+            else:
+                frame, consumed = self._parse_json(offset)
+
+            # Incomplete frame, wait for the next read
+            if consumed == 0:
+                break
+            offset += consumed
+            if frame is not None:
+                frames.append(frame)
+
+        # Drop everything already parsed, only the partial tail stays
+        del self._pending[:offset]
+        if len(self._pending) > self._max_pending_bytes:
+            self._decode_failures += 1
+            self._pending.clear()
+        return frames
+
+    # Check if a frame can start at this index
+    def _is_start(self, offset):
+        if self._active_protocol != 'json' and self._pending.startswith(FRAME_MAGIC, offset):
+            return True
+        return self._active_protocol != 'binary' and self._pending[offset] == ord('{')
+
+    # Index of the next possible frame start (or -1)
+    def _find_start(self, offset):
+        binary_start = self._pending.find(FRAME_MAGIC, offset) if self._active_protocol != 'json' else -1
+        json_start = self._pending.find(b'{', offset) if self._active_protocol != 'binary' else -1
+        starts = [start for start in (binary_start, json_start) if start >= 0]
+        return min(starts) if starts else -1
+
+    # Returns (frame, consumed bytes); consumed is 0 when more bytes are needed
+    def _parse_binary(self, offset):
+        if len(self._pending) - offset < FRAME_PREFIX.size:
+            return None, 0
+        try:
+            version = decode_version(self._pending, offset)
+            if len(self._pending) - offset < FRAME_HEADERS[version].size:
+                return None, 0
+            version, channels, sequence, timestamp, samples = decode_header(self._pending, offset)
+        except ValueError:
+            # Not a real header, skip the magic and resynchronize
+            self._decode_failures += 1
+            return None, len(FRAME_MAGIC)
+
+        length = frame_length(channels, samples, version)
+        if length > self._max_frame_bytes:
+            # Corrupted channels or samples, skip the magic and resynchronize now instead of waiting for the frame
+            self._decode_failures += 1
+            return None, len(FRAME_MAGIC)
+        if len(self._pending) - offset < length:
+            return None, 0
+        try:
+            # bytes() copies the frame out of the pending buffer, which is reused
+            with memoryview(self._pending) as view:
+                frame = decode_frame(bytes(view[offset:offset + length]))
+        except ValueError:
+            self._decode_failures += 1
+            return None, len(FRAME_MAGIC)
+        self._active_protocol = 'binary'
+        return frame, length
+
+    def _parse_json(self, offset):
+        end = self._pending.find(b'\n', offset)
+        if end < 0:
+            return None, 0
+        try:
+            frame = decode_json(self._pending[offset:end].decode('utf-8'))
+        except (ValueError, KeyError, TypeError):
+            # Truncated or corrupted line, resynchronize on the next '{' (a truncated
+            # line can be glued to the beginning of the next good one)
+            self._decode_failures += 1
+            return None, 1
+        return frame, end + 1 - offset
@@ -0,0 +1,113 @@
+import time
+import threading
+import collections
+
+# What to do when an item arrives and the queue is full
+QUEUE_POLICIES = ('drop_oldest', 'drop_newest', 'block', 'latest')
+
+# Bounded queue between two stages of the pipeline (e.g. the decision loop and the graphs)
+class StageQueueBias:
+    # Constructor
+    # 'latest' keeps only the newest item, so the consumer always works on the freshest one
+    def __init__(self, maxsize=2, policy='drop_oldest'):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unsupported policy {policy}")
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self._maxsize = 1 if policy == 'latest' else maxsize
+        self._policy = policy
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self.reset_stats()
+
+    # Define getters
+    def maxsize(self):
+        return self._maxsize
+
+    def policy(self):
+        return self._policy
+
+    def is_closed(self):
+        return self._closed
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items)
+
+    # Items discarded because the consumer didn't keep up
+    def dropped(self):
+        with self._condition:
+            return self._dropped_oldest + self._dropped_newest
+
+    # Start counting from zero
+    def reset_stats(self):
+        self._puts = 0
+        self._gets = 0
+        self._dropped_oldest = 0
+        self._dropped_newest = 0
+        self._blocked_time = 0.0
+        self._max_depth = 0
+
+    # Add an item applying the policy if the queue is full, returns False if the item was dropped (or the queue is closed)
+    def put(self, item, timeout=None):
+        with self._condition:
+            if self._closed:
+                return False
+            if len(self._items) >= self._maxsize:
+                if self._policy == 'drop_newest':
+                    self._dropped_newest += 1
+                    return False
+                if self._policy == 'block':
+                    # Wait for the consumer, the producer slows down to its pace
+                    start_time = time.monotonic()
+                    has_space = self._condition.wait_for(lambda: len(self._items) < self._maxsize or self._closed,
+                                                         timeout=timeout)
+                    self._blocked_time += time.monotonic() - start_time
+                    if self._closed:
+                        return False
+                    if not has_space:
+                        self._dropped_newest += 1
+                        return False
+                else:
+                    # drop_oldest and latest: the stale items make room for the new one
+                    while len(self._items) >= self._maxsize:
+                        self._items.popleft()
+                        self._dropped_oldest += 1
+            self._items.append(item)
+            self._puts += 1
+            self._max_depth = max(self._max_depth, len(self._items))
+            self._condition.notify_all()
+            return True
+
+    # Take the oldest item, waiting for one (None if the timeout expires or the queue is closed and empty)
+    def get(self, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self._closed, timeout=timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._gets += 1
+            self._condition.notify_all()
+            return item
+
+    # Stop accepting items and wake up everyone waiting (the consumer still gets what is left)
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    # Current values of the counters
+    def snapshot(self):
+        with self._condition:
+            return {
+                'policy': self._policy,
+                'size': len(self._items),
+                'maxsize': self._maxsize,
+                'max_depth': self._max_depth,
+                'puts': self._puts,
+                'gets': self._gets,
+                'dropped_oldest': self._dropped_oldest,
+                'dropped_newest': self._dropped_newest,
+                'blocked_time': self._blocked_time,
+            }
@@ -1,8 +1,16 @@
 import serial
 import time
+import threading
 import numpy as np
-import json
 from bias_graphing import GraphingBias
+from bias_buffer import RingBufferBias
+from bias_protocol import StreamParserBias, CalibrationBias
+from bias_stats import ReceptionStatsBias
+from bias_clock import ClockSyncBias
+from bias_latency import WindowBias
+
+# Channels sent by the firmware of one board
+DEFAULT_CHANNELS = 4
 
 def main():
     # Set constants
@@ -17,17 +25,250 @@ def main():
     biasGraphing = GraphingBias(graph_in_terminal=True)
     for ch, signal in signals.items():
         t = np.arange(len(signals[ch])) / fs
-        biasGraphing.graph_signal_voltage_time(t=t, signal=np.array(signal), title="Signal {}".format(ch))
+        biasGraphing.graph_signal_voltage_time(t=t, signal=np.asarray(signal), title="Signal {}".format(ch))
 
-class ReceptionBias:
+# State and logic shared by the threaded (ReceptionBias) and the asyncio (AsyncReceptionBias) receptions:
+# buffers, calibration, clock, stats and windows
+class ReceptionBaseBias:
     # Constructor
-    def __init__(self, port='/dev/serial0', baudrate=115200, timeout=1):
+    def __init__(self, port='/dev/serial0', baudrate=115200, buffer_capacity=10000, buffer_dtype=np.float32,
+                 protocol='auto', recorder=None, stats_callback=None, stats_interval=1.0, buffer=None, fs=None,
+                 calibration=None):
+        if protocol not in ('json', 'binary', 'auto'):
+            raise ValueError(f"Unsupported protocol {protocol}")
         self._port = port
         self._baudrate = baudrate
+        self._buffer_capacity = buffer_capacity
+        self._buffer_dtype = buffer_dtype
+        self._protocol = protocol
+        # Optional RecorderBias which persists every raw block received
+        self._recorder = recorder
+        # The frames carry raw uint16 ADC counts, they are converted to mV (by default) when buffered in a float buffer,
+        # integer buffers (e.g. buffer_dtype=np.uint16) keep the raw counts
+        self._calibration = calibration if calibration is not None else CalibrationBias()
+        # Throughput and loss counters (stats_callback receives them every stats_interval seconds)
+        self._stats = ReceptionStatsBias(callback=stats_callback, interval=stats_interval)
+        # Optional buffer given by the caller for the sessions (e.g. a SharedRingBufferBias read by other processes)
+        self._session_buffer = buffer
+        # With the sampling frequency of the board every sample of a session gets its host time of acquisition
+        # (from the timestamps of the frames mapped to the host clock) and of reception
+        self._fs = fs
+        self._clock = ClockSyncBias()
+        self._timing = None
+        self._buffer = None
+        self._parser = None
+        # Windows skipped because the consumer was behind (latest_only=True)
+        self._skipped_windows = 0
+
+    # Define getter of the sample buffer
+    def get_buffer(self):
+        return self._buffer
+
+    # Define getters of the acquisition and reception times of the buffered samples (None without fs)
+    def get_timing(self):
+        return self._timing
+
+    def get_clock(self):
+        return self._clock
+
+    # Current reception counters and rates
+    def get_stats(self):
+        stats = self._stats.snapshot(parser=self._parser, buffer=self._buffer)
+        stats['skipped_windows'] = self._skipped_windows
+        return stats
+
+    # Make the buffers of a new reception and forget the counters of the last one
+    def prepare_buffers(self, channels):
+        if self._session_buffer is not None:
+            self._buffer = self._session_buffer
+        else:
+            self._buffer = RingBufferBias(channels=channels, capacity=self._buffer_capacity, dtype=self._buffer_dtype)
+        # Same capacity as the samples so both buffers drop the same samples
+        self._timing = RingBufferBias(channels=2, capacity=self._buffer.capacity(), dtype=np.float64) \
+            if self._fs is not None else None
+        self._clock.reset()
+        self._stats.reset()
+        self._skipped_windows = 0
+
+    # Check the window and hop of an iteration before it starts
+    def check_window(self, window, hop):
+        if hop <= 0 or window <= 0:
+            raise ValueError("window and hop must be positive")
+        buffer = self._buffer if self._buffer is not None else self._session_buffer
+        capacity = buffer.capacity() if buffer is not None else self._buffer_capacity
+        if window > capacity:
+            raise ValueError(f"Window of {window} samples doesn't fit in a buffer of {capacity}")
+
+    # Current window of the first `channels` channels (None means all), called once `window` samples are buffered
+    # With latest_only a consumer slower than real time skips the windows it can't process and gets the newest one
+    def next_window(self, window, hop, channels=None, as_array=False, latest_only=False):
+        if latest_only:
+            # Jump hop by hop to the newest complete window
+            skipped = (self._buffer.available() - window) // hop
+            if skipped > 0:
+                self._skipped_windows += skipped
+                self.advance_samples(skipped * hop)
+        # The window is a view of the buffer, only hop samples are consumed after it so the rest is reused
+        block = self._buffer.peek(window)[:channels]
+        if as_array:
+            return block
+        # The window also carries the times of its samples, so each stage can be traced on it
+        times = self._timing.peek(window) if self._timing is not None else None
+        return WindowBias(self.block_to_signals(block), times=times)
+
+    # Consume n samples (and their times)
+    def advance_samples(self, n):
+        self._buffer.advance(n)
+        if self._timing is not None:
+            self._timing.advance(n)
+
+    # Save a decoded frame in the buffer (and in the recording if there is one)
+    # timing receives the acquisition and reception time of each sample
+    def store_frame(self, buffer, frame, channels, timing=None):
+        received_time = time.monotonic()
+        device_time = self.sync_frame(frame, received_time)
+        samples = frame.samples[:channels]
+        self._stats.record_frame(frame, now=received_time)
+        # The recording keeps the raw counts
+        if self._recorder is not None:
+            self._recorder.append(samples, sequence=frame.sequence)
+        # The times go first, consumers are woken up by the samples
+        if timing is not None:
+            timing.write(self.sample_times(device_time, received_time, samples.shape[1]))
+        buffer.write(self._calibration.apply_for(samples, buffer.dtype()))
+
+    # Map the timestamp of a frame to the host clock, returns the board time of its first sample (None without timestamp)
+    def sync_frame(self, frame, received_time):
+        if self._fs is None or frame.timestamp is None:
+            return None
+        device_time = self._clock.unwrap(frame.timestamp)
+        # The frame is received after its last sample
+        self._clock.update(device_time + (frame.samples.shape[1] - 1) / self._fs, received_time)
+        return device_time
+
+    # 2 x samples array with the host time of acquisition and of reception of consecutive samples
+    def sample_times(self, device_time, received_time, number_of_samples):
+        offsets = np.arange(number_of_samples) / self._fs
+        if device_time is None:
+            # Without timestamps the last sample is assumed to be acquired when it's received
+            acquired_times = received_time - offsets[::-1]
+        else:
+            acquired_times = self._clock.to_host(device_time + offsets)
+        return np.stack([acquired_times, np.full(number_of_samples, received_time)])
+
+    # Expose each row of a channels x samples block as a channel of the dict API (views, no copies)
+    def block_to_signals(self, block):
+        return {f'ch{ch}': block[ch] for ch in range(block.shape[0])}
+
+class ReceptionBias(ReceptionBaseBias):
+    # Constructor
+    def __init__(self, port='/dev/serial0', baudrate=115200, timeout=1, buffer_capacity=10000, buffer_dtype=np.float32,
+                 protocol='auto', recorder=None, stats_callback=None, stats_interval=1.0, buffer=None, fs=None,
+                 calibration=None):
+        super().__init__(port=port, baudrate=baudrate, buffer_capacity=buffer_capacity, buffer_dtype=buffer_dtype,
+                         protocol=protocol, recorder=recorder, stats_callback=stats_callback,
+                         stats_interval=stats_interval, buffer=buffer, fs=fs, calibration=calibration)
         self._timeout = timeout
 
+        # Session state (port kept open by a background reader thread)
+        self._session_thread = None
+        self._session_running = threading.Event()
+
+    # Use the reception as a context manager for a long-lived session
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_session()
+
+    # Check if the background session is running
+    def session_is_running(self):
+        return self._session_running.is_set()
+
+    # Open the port once and keep reading it in a background thread
+    def start_session(self, channels):
+        if self.session_is_running():
+            return
+        if self._session_thread is not None:
+            # The last session ended by itself (e.g. serial error), join its thread and close its port first
+            self.stop_session()
+        self.prepare_buffers(channels)
+        self.open_session_source()
+        self._session_running.set()
+        self._session_thread = threading.Thread(target=self._session_loop, name=f"{type(self).__name__}Session", daemon=True)
+        self._session_thread.start()
+
+    # Stop the reader thread and close the port
+    def stop_session(self):
+        if self._session_thread is None:
+            return
+        self._session_running.clear()
+        # Wake up any consumer waiting for samples
+        self._buffer.notify_all()
+        self._session_thread.join()
+        self._session_thread = None
+        self.close_session_source()
+
+    # Open the source read by the session thread (the serial port)
+    def open_session_source(self):
+        self._parser = StreamParserBias(protocol=self._protocol)
+        self._ser = self.init_serial(self._port, self._baudrate, self._timeout)
+
+    def close_session_source(self):
+        self._ser.close()
+
+    # Background loop which reads the UART continuously into the session buffer
+    def _session_loop(self):
+        try:
+            while self._session_running.is_set():
+                try:
+                    # The timeout of the port bounds how long we block here
+                    for frame in self.read_frames(self._parser):
+                        self.store_frame(self._buffer, frame, self._buffer.channels(), timing=self._timing)
+                    self._stats.maybe_report(parser=self._parser, buffer=self._buffer)
+                except serial.SerialException as e:
+                    print(f"Serial error in reception session: {e}")
+                    break
+                except ValueError as e:
+                    print(f"Can't be decoded: {e}")
+        finally:
+            # Wake up consumers so they don't wait forever on a dead session
+            self._session_running.clear()
+            self._buffer.notify_all()
+
+    # Take the next n samples of each channel from the session buffer
+    def take_session_samples(self, channels, n):
+        # Wait until the reader thread has buffered enough samples
+        if not self._buffer.wait_for_samples(n, running_event=self._session_running):
+            raise RuntimeError("Reception session stopped before enough samples were received")
+        if self._timing is not None:
+            self._timing.advance(n)
+        return self.block_to_signals(self._buffer.read(n)[:channels])
+
+    # Yield overlapping windows of the last `window` samples every `hop` new samples
+    # With latest_only a consumer slower than real time skips the windows it can't process and always gets the newest one
+    # channels=None gives every channel of the session buffer
+    def iter_windows(self, window, hop, channels=None, as_array=False, latest_only=False):
+        self.check_window(window, hop)
+
+        # Open a session for the iteration if there isn't one already
+        started_here = not self.session_is_running()
+        if started_here:
+            self.start_session(channels=channels if channels is not None else DEFAULT_CHANNELS)
+        try:
+            while self._buffer.wait_for_samples(window, running_event=self._session_running):
+                yield self.next_window(window, hop, channels=channels, as_array=as_array, latest_only=latest_only)
+                self.advance_samples(hop)
+        finally:
+            if started_here:
+                self.stop_session()
+
     # Get the data from the RP2040 Zero
     def get_real_data(self, channels, n):
+        # Use the open session if there is one
+        if self.session_is_running():
+            return self.take_session_samples(channels=channels, n=n)
+
         # Initialize serial communication
         self._ser = self.init_serial(self._port, self._baudrate, self._timeout)
         try:
@@ -38,46 +279,39 @@ class ReceptionBias:
             self._ser.close()
 
     def capture_signals(self, channels, n):
-        # Initialize variables
-        signals = {f'ch{ch}': [] for ch in range(channels)}
-        start_time = time.time()
-       # Loop until we have enough samples
-        while len(signals['ch3']) < n: 
-            if self._ser.in_waiting > 0:
-                try:
-                    # Read one line to detect \n character
-                    data = self._ser.readline().decode('utf-8').strip()
-                    eeg_data = self.process_data(data)
-                    # Make an array with the data
-                    if eeg_data:
-                        for ch in range(channels):
-                            signals[f'ch{ch}'].extend(eeg_data[f'ch{ch}'])
-                except Exception as e:
-                    print("Can't be decoded")
+        # The session thread owns the port, so take the samples from its buffer
+        if self.session_is_running():
+            return self.take_session_samples(channels=channels, n=n)
 
+        # Preallocated buffer big enough for n samples plus the tail of the last block
+        buffer = RingBufferBias(channels=channels, capacity=max(n, self._buffer_capacity), dtype=self._buffer_dtype)
+        parser = StreamParserBias(protocol=self._protocol)
+        start_time = time.time()
+        # Loop until we have enough samples (reads block until data arrives or the timeout expires)
+        while buffer.available() < n:
+            try:
+                # Write the complete frames in the buffer, partial ones stay in the parser
+                for frame in self.read_frames(parser):
+                    self.store_frame(buffer, frame, channels)
+            except ValueError as e:
+                print(f"Can't be decoded: {e}")
 
         # Check the time it takes to read
         elapsed_time = time.time() - start_time
         print(f"elapsed time: {elapsed_time}")
-        # Ensure all signals have the correct length
-        for ch in range(channels):
-            signals[f'ch{ch}'] = signals[f'ch{ch}'][:n]
 
-        return signals
+        # Only the first n samples are returned
+        return self.block_to_signals(buffer.read(n))
+
+    # Read whatever the UART has (blocking up to the timeout for the first byte) and parse it
+    def read_frames(self, parser):
+        data = self._ser.read(self._ser.in_waiting or 1)
+        self._stats.record_bytes(len(data))
+        return parser.feed(data) if data else []
 
     # Initialize serial communication
     def init_serial(self, port, baudrate, timeout):
         return serial.Serial(port, baudrate, timeout=timeout)
 
-    # Load JSON data
-    def process_data(self, data):
-        try:
-            json_data = json.loads(data)
-            print(json_data)
-            return json_data
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON: {e}")
-            return None
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,124 @@
+import asyncio
+import serial
+import numpy as np
+from bias_protocol import StreamParserBias
+from bias_reception import ReceptionBaseBias
+
+def main():
+    asyncio.run(print_windows())
+
+# Print the shape of each window received while other tasks could run in the same loop
+async def print_windows():
+    n = 1000
+    hop = 125
+    number_of_channels = 4
+    async with AsyncReceptionBias(channels=number_of_channels) as biasReception:
+        async for signals in biasReception.windows(window=n, hop=hop):
+            print({ch: signal.shape for ch, signal in signals.items()})
+
+class AsyncReceptionBias(ReceptionBaseBias):
+    # Constructor
+    def __init__(self, port='/dev/serial0', baudrate=115200, channels=4, buffer_capacity=10000, buffer_dtype=np.float32,
+                 protocol='auto', n=1000, recorder=None, stats_callback=None, stats_interval=1.0, calibration=None):
+        super().__init__(port=port, baudrate=baudrate, buffer_capacity=buffer_capacity, buffer_dtype=buffer_dtype,
+                         protocol=protocol, recorder=recorder, stats_callback=stats_callback,
+                         stats_interval=stats_interval, calibration=calibration)
+        self._channels = channels
+        # Block size used when iterating directly over the reception
+        self._n = n
+
+        self._loop = None
+        self._ser = None
+        self._data_event = None
+        self._error = None
+
+    # Open the port when entering the context and close it when leaving
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    # Iterate over consecutive blocks of n samples
+    def __aiter__(self):
+        return self.windows(window=self._n, hop=self._n)
+
+    # Check if the port is open
+    def is_open(self):
+        return self._ser is not None
+
+    # Open the serial port and let the event loop call us when it has data
+    async def open(self):
+        if self.is_open():
+            return
+        self._loop = asyncio.get_running_loop()
+        self.prepare_buffers(self._channels)
+        self._parser = StreamParserBias(protocol=self._protocol)
+        self._data_event = asyncio.Event()
+        self._error = None
+        # Non-blocking port, reads only happen when the file descriptor is readable
+        self._ser = self.init_serial(self._port, self._baudrate)
+        self._loop.add_reader(self._ser.fileno(), self._on_readable)
+
+    # Stop watching the port and close it
+    async def close(self):
+        if not self.is_open():
+            return
+        self._loop.remove_reader(self._ser.fileno())
+        self._ser.close()
+        self._ser = None
+        # Wake up any consumer waiting for samples
+        self._data_event.set()
+
+    # Initialize serial communication
+    def init_serial(self, port, baudrate):
+        return serial.Serial(port, baudrate, timeout=0)
+
+    # Called by the event loop when the port has bytes to read
+    def _on_readable(self):
+        try:
+            data = self._ser.read(self._ser.in_waiting or 1)
+            self._stats.record_bytes(len(data))
+            for frame in self._parser.feed(data):
+                self.store_frame(self._buffer, frame, self._channels, timing=self._timing)
+        except serial.SerialException as e:
+            # The port is gone, stop reading and report it to the consumers
+            self._error = e
+            self._loop.remove_reader(self._ser.fileno())
+        except ValueError as e:
+            print(f"Can't be decoded: {e}")
+        self._stats.maybe_report(parser=self._parser, buffer=self._buffer)
+        self._data_event.set()
+
+    # Wait (without blocking the loop) until n unread samples are buffered
+    async def _wait_for_samples(self, n):
+        while self._buffer.available() < n:
+            if self._error is not None:
+                raise self._error
+            if not self.is_open():
+                raise RuntimeError("Reception closed before enough samples were received")
+            self._data_event.clear()
+            await self._data_event.wait()
+
+    # Take the next n samples of each channel
+    async def read(self, n):
+        await self._wait_for_samples(n)
+        return self.block_to_signals(self._buffer.read(n))
+
+    # Yield overlapping windows of the last `window` samples every `hop` new samples
+    # With latest_only a consumer slower than real time skips the windows it can't process and always gets the newest one
+    # channels=None gives every channel of the buffer
+    async def windows(self, window, hop, channels=None, as_array=False, latest_only=False):
+        self.check_window(window, hop)
+        while True:
+            try:
+                await self._wait_for_samples(window)
+            except RuntimeError:
+                # The reception was closed, end the iteration
+                return
+            yield self.next_window(window, hop, channels=channels, as_array=as_array, latest_only=latest_only)
+            self.advance_samples(hop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import time
+import numpy as np
+from bias_reception import ReceptionBias
+from bias_clock import ClockSyncBias
+
+def main():
+    n = 1000
+    fs = 500
+    hop = 125
+    # Two boards of 4 channels each
+    ports = ['/dev/ttyUSB0', '/dev/ttyUSB1']
+    with MultiReceptionBias(ports=ports, fs=fs, channels_per_device=4) as biasReception:
+        for signals in biasReception.iter_windows(window=n, hop=hop, channels=biasReception.total_channels()):
+            print({ch: signal.shape for ch, signal in signals.items()})
+            for device, stats in enumerate(biasReception.get_stats()['devices']):
+                print(f"Board {device}: drift {stats['clock_drift_ppm']:.1f} ppm, "
+                      f"filled samples {stats['filled_samples']}")
+
+# Reception of one board which keeps its samples evenly spaced in the board time (lost frames are filled)
+class DeviceReceptionBias(ReceptionBias):
+    # Constructor
+    def __init__(self, port, fs, baudrate=115200, timeout=1, buffer_capacity=10000, buffer_dtype=np.float32,
+                 protocol='auto', recorder=None, history=256, calibration=None):
+        super().__init__(port=port, baudrate=baudrate, timeout=timeout, buffer_capacity=buffer_capacity,
+                         buffer_dtype=buffer_dtype, protocol=protocol, recorder=recorder, fs=fs, calibration=calibration)
+        self._clock = ClockSyncBias(history=history)
+        self._anchor_time = None
+        self._next_device_time = None
+        self._filled_samples = 0
+
+    # Define getters
+    def is_synchronized(self):
+        return self._clock.is_synchronized() and self._buffer is not None and self._buffer.total_written() > 1
+
+    # Absolute index of the oldest unread sample of the buffer
+    def first_index(self):
+        return self._buffer.total_written() - self._buffer.available()
+
+    # Host time of an absolute sample index and the other way around
+    def sample_host_time(self, index):
+        return self._clock.to_host(self._anchor_time + index / self._fs)
+
+    def sample_index(self, host_time):
+        return (self._clock.to_device(host_time) - self._anchor_time) * self._fs
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats['clock_drift_ppm'] = self._clock.drift_ppm()
+        stats['filled_samples'] = self._filled_samples
+        return stats
+
+    def start_session(self, channels):
+        self._anchor_time = None
+        self._next_device_time = None
+        self._filled_samples = 0
+        super().start_session(channels=channels)
+
+    # Map the timestamp of a frame keeping sample index and board time proportional
+    def sync_frame(self, frame, received_time):
+        buffer = self._buffer
+        number_of_samples = frame.samples.shape[1]
+        if frame.timestamp is not None:
+            device_time = self._clock.unwrap(frame.timestamp)
+        else:
+            # Boards which don't send timestamps are assumed to lose nothing
+            device_time = self._next_device_time if self._next_device_time is not None else 0.0
+
+        if self._next_device_time is not None:
+            gap = int(round((device_time - self._next_device_time) * self._fs))
+            if gap < -self._fs or gap > buffer.capacity():
+                # The board restarted (or was silent too long), start the mapping again from this frame
+                self._clock.reset()
+                if frame.timestamp is not None:
+                    device_time = self._clock.unwrap(frame.timestamp)
+                self._anchor_time = device_time - buffer.total_written() / self._fs
+            elif gap > 0:
+                # Lost frames, repeat the last sample so the following ones keep their place in time
+                if self._timing is not None:
+                    self._timing.write(self.sample_times(self._next_device_time, received_time, gap))
+                buffer.write(np.repeat(buffer.latest(1), gap, axis=1))
+                self._filled_samples += gap
+        else:
+            self._anchor_time = device_time - buffer.total_written() / self._fs
+
+        # The frame is received after its last sample
+        self._clock.update(device_time + (number_of_samples - 1) / self._fs, received_time)
+        self._next_device_time = device_time + number_of_samples / self._fs
+        return device_time
+
+# Merges the channels of several boards in one channels x samples stream on a common time base
+class MultiReceptionBias(ReceptionBias):
+    # Constructor
+    # block_size is the number of merged samples produced at once
+    # calibration is one CalibrationBias for every board or a list with one per board
+    def __init__(self, ports, fs, channels_per_device=4, baudrate=115200, timeout=1, buffer_capacity=10000,
+                 buffer_dtype=np.float32, protocol='auto', block_size=None, history=256, stats_callback=None,
+                 stats_interval=1.0, buffer=None, calibration=None):
+        super().__init__(port=None, baudrate=baudrate, timeout=timeout, buffer_capacity=buffer_capacity,
+                         buffer_dtype=buffer_dtype, protocol=protocol, stats_callback=stats_callback,
+                         stats_interval=stats_interval, buffer=buffer, fs=fs)
+        self._channels_per_device = channels_per_device
+        self._block_size = block_size if block_size is not None else max(1, fs // 10)
+        calibrations = calibration if isinstance(calibration, (list, tuple)) else [calibration] * len(ports)
+        self._devices = [DeviceReceptionBias(port=port, fs=fs, baudrate=baudrate, timeout=timeout,
+                                             buffer_capacity=buffer_capacity, buffer_dtype=buffer_dtype,
+                                             protocol=protocol, history=history, calibration=device_calibration)
+                         for port, device_calibration in zip(ports, calibrations)]
+        self._next_host_time = None
+
+    # Define getters
+    def total_channels(self):
+        return len(self._devices) * self._channels_per_device
+
+    def get_devices(self):
+        return self._devices
+
+    def get_stats(self):
+        stats = self._stats.snapshot(buffer=self._buffer)
+        stats['skipped_windows'] = self._skipped_windows
+        stats['devices'] = [device.get_stats() for device in self._devices]
+        return stats
+
+    # The merged buffer always has the channels of every board
+    def start_session(self, channels=None):
+        super().start_session(channels=self.total_channels())
+
+    # The sources are the sessions of each board
+    def open_session_source(self):
+        self._next_host_time = None
+        for device in self._devices:
+            device.start_session(channels=self._channels_per_device)
+
+    def close_session_source(self):
+        for device in self._devices:
+            device.stop_session()
+
+    # Background loop which resamples every board on the host time and writes the merged block
+    def _session_loop(self):
+        try:
+            while self._session_running.is_set():
+                if not all(device.session_is_running() for device in self._devices):
+                    print("A board of the multi-board reception stopped")
+                    break
+                if self._next_host_time is None:
+                    if not all(device.is_synchronized() for device in self._devices):
+                        time.sleep(0.01)
+                        continue
+                    # Start when every board has samples
+                    self._next_host_time = max(device.sample_host_time(device.first_index()) for device in self._devices)
+
+                merged = self._merge_block()
+                if merged is None:
+                    continue
+                block, times = merged
+                if self._timing is not None:
+                    self._timing.write(times)
+                self._buffer.write(block)
+                self._next_host_time += self._block_size / self._fs
+                self._stats.maybe_report(buffer=self._buffer)
+        finally:
+            # Wake up consumers so they don't wait forever on a dead session
+            self._session_running.clear()
+            self._buffer.notify_all()
+
+    # Interpolate the next block of every board on the common time base, returns (block, times) or None if a board is behind
+    def _merge_block(self):
+        host_times = self._next_host_time + np.arange(self._block_size) / self._fs
+        positions = []
+        for device in self._devices:
+            buffer = device.get_buffer()
+            first_index = device.first_index()
+            position = np.maximum(device.sample_index(host_times) - first_index, 0)
+            # The sample after the last position is needed to interpolate
+            needed = int(position[-1]) + 2
+            if needed > buffer.capacity():
+                # This board is too far ahead of the others, drop its oldest samples
+                buffer.advance(needed - buffer.capacity())
+                device.get_timing().advance(needed - buffer.capacity())
+                return None
+            if not buffer.wait_for_samples(needed, timeout=0.1):
+                return None
+            positions.append(position)
+
+        block = np.empty((self.total_channels(), self._block_size), dtype=self._buffer_dtype)
+        # A merged sample is received when the last board delivers its part
+        received_time = 0.0
+        for number, (device, position) in enumerate(zip(self._devices, positions)):
+            buffer = device.get_buffer()
+            lower = position.astype(np.int64)
+            weight = position - lower
+            samples = buffer.peek(int(lower[-1]) + 2)
+            rows = slice(number * self._channels_per_device, (number + 1) * self._channels_per_device)
+            block[rows] = samples[:, lower] * (1 - weight) + samples[:, lower + 1] * weight
+            received_time = max(received_time, device.get_timing().peek(int(lower[-1]) + 2)[1, -1])
+            # Keep the samples still needed by the next block
+            buffer.advance(int(lower[-1]))
+            device.get_timing().advance(int(lower[-1]))
+        return block, np.stack([host_times, np.full(self._block_size, received_time)])
+
+    # Without a session, open one just for these samples
+    def get_real_data(self, channels, n):
+        return self.capture_signals(channels=channels, n=n)
+
+    def capture_signals(self, channels, n):
+        if self.session_is_running():
+            return self.take_session_samples(channels=channels, n=n)
+        self.start_session()
+        try:
+            return self.take_session_samples(channels=channels, n=n)
+        finally:
+            self.stop_session()
+
+if __name__ == "__main__":
+    main()
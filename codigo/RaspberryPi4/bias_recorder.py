@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import numpy as np
+
+# One record per received block, in the .blocks file
+BLOCK_DTYPE = np.dtype([('sequence', '<i8'), ('host_time', '<f8'), ('first_sample', '<i8'), ('samples', '<u4')])
+RECORDING_VERSION = 1
+
+def main():
+    path = input("Write the path of the recording (without extension): ")
+    header, samples, blocks = load_recording(path)
+    print(header)
+    print(f"Samples: {samples.shape}, blocks: {blocks.shape}")
+
+# Open a recording without loading it in memory, returns (header, samples, blocks)
+# samples is a samples x channels memmap and blocks a memmap of BLOCK_DTYPE records
+def load_recording(path):
+    with open(f"{path}.json") as header_file:
+        header = json.load(header_file)
+    channels = header['channels']
+    number_of_samples = header['samples']
+    number_of_blocks = header['blocks']
+
+    samples = np.memmap(f"{path}.samples", dtype=header['dtype'], mode='r', shape=(number_of_samples, channels)) \
+        if number_of_samples else np.zeros((0, channels), dtype=header['dtype'])
+    blocks = np.memmap(f"{path}.blocks", dtype=BLOCK_DTYPE, mode='r', shape=(number_of_blocks,)) \
+        if number_of_blocks else np.zeros(0, dtype=BLOCK_DTYPE)
+    return header, samples, blocks
+
+class RecorderBias:
+    # Constructor
+    def __init__(self, path, channels, fs, dtype=np.uint16, growth_samples=None):
+        self._path = path
+        self._channels = channels
+        self._fs = fs
+        self._dtype = np.dtype(dtype).newbyteorder('<')
+        # The files grow in chunks so appending is only a copy into the memmap
+        self._growth_samples = growth_samples if growth_samples is not None else int(fs * 60)
+
+        self._samples = None
+        self._blocks = None
+        self._samples_capacity = 0
+        self._blocks_capacity = 0
+        self._number_of_samples = 0
+        self._number_of_blocks = 0
+        self._start_time = None
+
+    # Use the recorder as a context manager
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Define getters
+    def is_open(self):
+        return self._samples is not None
+
+    def number_of_samples(self):
+        return self._number_of_samples
+
+    def number_of_blocks(self):
+        return self._number_of_blocks
+
+    # Create the files of the recording
+    def open(self):
+        if self.is_open():
+            return
+        self._start_time = time.time()
+        self._number_of_samples = 0
+        self._number_of_blocks = 0
+        # Truncate any previous recording with the same name
+        open(f"{self._path}.samples", 'wb').close()
+        open(f"{self._path}.blocks", 'wb').close()
+        self._grow_samples(self._growth_samples)
+        self._grow_blocks(max(1, self._growth_samples // 100))
+        self.write_header()
+
+    # Append a channels x samples block received from the board
+    def append(self, samples, sequence=None, host_time=None):
+        samples = np.asarray(samples)
+        if samples.shape[0] != self._channels:
+            raise ValueError(f"Expected {self._channels} channels, got {samples.shape[0]}")
+        number_of_samples = samples.shape[1]
+
+        # Make room in the files if needed
+        if self._number_of_samples + number_of_samples > self._samples_capacity:
+            self._grow_samples(max(self._growth_samples, number_of_samples))
+        if self._number_of_blocks + 1 > self._blocks_capacity:
+            self._grow_blocks(self._blocks_capacity)
+
+        # Samples are stored interleaved (samples x channels) so the file only grows at the end
+        self._samples[self._number_of_samples:self._number_of_samples + number_of_samples] = samples.T
+        self._blocks[self._number_of_blocks] = (sequence if sequence is not None else -1,
+                                                host_time if host_time is not None else time.time(),
+                                                self._number_of_samples, number_of_samples)
+        self._number_of_samples += number_of_samples
+        self._number_of_blocks += 1
+
+    # Flush the data and cut the files to the real size
+    def close(self):
+        if not self.is_open():
+            return
+        self._samples.flush()
+        self._blocks.flush()
+        self._samples = None
+        self._blocks = None
+        os.truncate(f"{self._path}.samples", self._number_of_samples * self._channels * self._dtype.itemsize)
+        os.truncate(f"{self._path}.blocks", self._number_of_blocks * BLOCK_DTYPE.itemsize)
+        self._samples_capacity = 0
+        self._blocks_capacity = 0
+        self.write_header()
+
+    # Small JSON description of the binary files
+    def write_header(self):
+        header = {
+            'version': RECORDING_VERSION,
+            'channels': self._channels,
+            'fs': self._fs,
+            'dtype': self._dtype.str,
+            'layout': 'samples x channels',
+            'samples': self._number_of_samples,
+            'blocks': self._number_of_blocks,
+            'start_time': self._start_time,
+        }
+        with open(f"{self._path}.json", 'w') as header_file:
+            json.dump(header, header_file, indent=4)
+
+    # Extend the samples file and map it again
+    def _grow_samples(self, extra_samples):
+        if self._samples is not None:
+            self._samples.flush()
+            # Keep the header up to date in case the recording isn't closed properly
+            self.write_header()
+        self._samples_capacity += extra_samples
+        os.truncate(f"{self._path}.samples", self._samples_capacity * self._channels * self._dtype.itemsize)
+        self._samples = np.memmap(f"{self._path}.samples", dtype=self._dtype, mode='r+',
+                                  shape=(self._samples_capacity, self._channels))
+
+    # Extend the blocks file and map it again
+    def _grow_blocks(self, extra_blocks):
+        if self._blocks is not None:
+            self._blocks.flush()
+        self._blocks_capacity += extra_blocks
+        os.truncate(f"{self._path}.blocks", self._blocks_capacity * BLOCK_DTYPE.itemsize)
+        self._blocks = np.memmap(f"{self._path}.blocks", dtype=BLOCK_DTYPE, mode='r+', shape=(self._blocks_capacity,))
+
+if __name__ == "__main__":
+    main()
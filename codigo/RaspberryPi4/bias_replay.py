@@ -0,0 +1,296 @@
+import os
+import pty
+import tty
+import time
+import select
+import threading
+import numpy as np
+from bias_reception import ReceptionBias
+from bias_recorder import load_recording
+from bias_protocol import FrameBias, CalibrationBias, encode_frame, ADC_MAX_COUNT, ADC_MID_SCALE
+from bias_dsp import FilterBias, ProcessingBias
+
+def main():
+    # TensorFlow is only loaded by the demo and the synthetic source
+    from bias_ai import AIBias
+    n = 1000
+    fs = 500
+    hop = 125
+    number_of_channels = 4
+    commands = ["forward", "backwards", "left", "right", "stop", "rest"]
+
+    # Replay one minute of synthetic EEG as fast as the pipeline can take it
+    samples, fs = synthetic_source(duration=60, channels=number_of_channels, fs=fs)
+    biasReplay = ReplayBias(samples=samples, fs=fs, speed=None)
+    biasFilter = FilterBias(n=n, fs=fs, notch=True, bandpass=True, fir=False, iir=False)
+    biasProcessing = ProcessingBias(n=n, fs=fs, filter_instance=biasFilter)
+    biasAI = AIBias(n=n, fs=fs, channels=number_of_channels, commands=commands, processing_instance=biasProcessing)
+
+    results = benchmark_pipeline(biasReplay, biasFilter, biasProcessing, biasAI, window=n, hop=hop,
+                                 channels=number_of_channels, number_of_windows=100)
+    print(f"Windows per second: {results['windows_per_second']:.2f}")
+    for stage, seconds in results['stage_seconds'].items():
+        print(f"{stage}: {seconds * 1000:.2f} ms per window")
+
+# channels x samples array and sampling frequency of a recording made by RecorderBias (memory-mapped)
+def recording_source(path):
+    header, samples, _ = load_recording(path)
+    return samples.T, header['fs']
+
+# channels x samples array with every trial of a BCI IV 2a MotorImageryDataset one after the other
+def bci_dataset_source(dataset, channels=[0, 7, 9, 11]):
+    trials, _ = dataset.get_trials_from_channels(channels)
+    return np.stack([trials_of_channel.reshape(-1) for trials_of_channel in trials]), dataset.Fs
+
+# channels x samples array of synthetic EEG
+def synthetic_source(duration, channels, fs, command=None):
+    from bias_ai import generate_synthetic_eeg
+    data = generate_synthetic_eeg(n_samples=int(duration * fs), n_channels=channels, fs=fs, command=command)
+    return np.stack([data[ch] for ch in range(channels)]), fs
+
+# Run the full filter -> process -> features -> predict pipeline on the windows of a source and time it
+def benchmark_pipeline(source, filter_instance, processing_instance, ai_instance, window, hop, channels, number_of_windows):
+    stage_seconds = {"filter": 0.0, "processing": 0.0, "features": 0.0, "prediction": 0.0}
+    windows = 0
+    start_time = time.perf_counter()
+    for signals in source.iter_windows(window=window, hop=hop, channels=channels):
+        stage_start = time.perf_counter()
+        filtered_data = filter_instance.filter_signals(signals)
+        stage_seconds["filter"] += time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        _, eeg_signals = processing_instance.process_signals(filtered_data)
+        stage_seconds["processing"] += time.perf_counter() - stage_start
+
+        # Without a trained model only the features can be timed
+        stage_start = time.perf_counter()
+        if ai_instance.ai_is_trained():
+            ai_instance.predict_command(eeg_data=eeg_signals)
+            stage_seconds["prediction"] += time.perf_counter() - stage_start
+        else:
+            ai_instance.extract_features(eeg_signals)
+            stage_seconds["features"] += time.perf_counter() - stage_start
+
+        windows += 1
+        if windows >= number_of_windows:
+            break
+
+    elapsed_time = time.perf_counter() - start_time
+    return {
+        "windows": windows,
+        "elapsed_time": elapsed_time,
+        "windows_per_second": windows / elapsed_time if elapsed_time > 0 else 0.0,
+        "stage_seconds": {stage: seconds / max(windows, 1) for stage, seconds in stage_seconds.items()},
+    }
+
+# Same interface as ReceptionBias, fed in-process from an array instead of the UART
+class ReplayBias(ReceptionBias):
+    # Constructor
+    # speed is a multiplier of real time, None replays as fast as the consumer reads
+    # Integer sources (recordings) are raw ADC counts and get the default calibration, float ones are left as they are
+    def __init__(self, samples, fs, speed=1.0, block_size=1000, loop=False, buffer_capacity=10000, buffer_dtype=np.float32,
+                 recorder=None, stats_callback=None, stats_interval=1.0, buffer=None, calibration=None):
+        samples = np.asarray(samples)
+        if calibration is None and not np.issubdtype(samples.dtype, np.integer):
+            calibration = CalibrationBias.identity()
+        super().__init__(port=None, buffer_capacity=buffer_capacity, buffer_dtype=buffer_dtype, recorder=recorder,
+                         stats_callback=stats_callback, stats_interval=stats_interval, buffer=buffer, fs=fs,
+                         calibration=calibration)
+        self._samples = samples
+        self._speed = speed
+        self._block_size = block_size
+        self._loop = loop
+        self._position = 0
+        self._sequence = 0
+        self._emitted_samples = 0
+
+    # Go back to the beginning of the source
+    def rewind(self):
+        self._position = 0
+
+    # Next block of the source (None when it's over)
+    def next_block(self, size):
+        if self._position >= self._samples.shape[1]:
+            if not self._loop:
+                return None
+            self._position = 0
+        block = self._samples[:, self._position:self._position + size]
+        self._position += block.shape[1]
+        # Timestamp of the first sample in microseconds, like the firmware (it keeps going when the source loops)
+        frame = FrameBias(sequence=self._sequence, samples=block,
+                          timestamp=int(self._emitted_samples * 1e6 / self._fs) & 0xFFFFFFFF)
+        self._sequence += 1
+        self._emitted_samples += block.shape[1]
+        return frame
+
+    # There is no port to open
+    def open_session_source(self):
+        self._replay_start = time.monotonic()
+        self._replayed_samples = 0
+
+    def close_session_source(self):
+        pass
+
+    # Background loop which pushes the source into the session buffer at the selected speed
+    def _session_loop(self):
+        try:
+            while self._session_running.is_set():
+                block_size = self._block_size
+                if not self._speed:
+                    # As fast as possible, but without overwriting samples that weren't read
+                    # Only what fits is written: waiting for a whole block could wait forever for a consumer which
+                    # itself waits for more samples than the buffer can take meanwhile
+                    if not self._buffer.wait_for_space(1, running_event=self._session_running):
+                        break
+                    block_size = min(block_size, self._buffer.free_space())
+                frame = self.next_block(block_size)
+                if frame is None:
+                    break
+                if self._speed:
+                    # Wait until the block would have been received at the selected speed
+                    self._replayed_samples += frame.samples.shape[1]
+                    due_time = self._replay_start + self._replayed_samples / (self._fs * self._speed)
+                    while self._session_running.is_set() and time.monotonic() < due_time:
+                        time.sleep(min(due_time - time.monotonic(), 0.1))
+                self.store_frame(self._buffer, frame, self._buffer.channels(), timing=self._timing)
+                self._stats.maybe_report(buffer=self._buffer)
+        finally:
+            # Wake up consumers so they don't wait forever on a finished replay
+            self._session_running.clear()
+            self._buffer.notify_all()
+
+    # Get the data without a session (no timing, straight from the source)
+    def get_real_data(self, channels, n):
+        return self.capture_signals(channels=channels, n=n)
+
+    def capture_signals(self, channels, n):
+        if self.session_is_running():
+            return self.take_session_samples(channels=channels, n=n)
+
+        block = np.empty((channels, n), dtype=self._buffer_dtype)
+        filled = 0
+        while filled < n:
+            frame = self.next_block(n - filled)
+            if frame is None:
+                raise RuntimeError("Replay source ended before enough samples were read")
+            samples = frame.samples[:channels]
+            self._stats.record_frame(frame)
+            if self._recorder is not None:
+                self._recorder.append(samples, sequence=frame.sequence)
+            block[:, filled:filled + samples.shape[1]] = self._calibration.apply_for(samples, self._buffer_dtype)
+            filled += samples.shape[1]
+        return self.block_to_signals(block)
+
+# Writes a source as binary frames into a pseudo-terminal, so a real ReceptionBias can read it from port_name()
+class PtyReplayBias:
+    # Constructor
+    # Samples are sent as 12-bit ADC counts, like the firmware. Integer sources (recordings) are already counts, float
+    # ones are converted with the inverse of calibration (the one of the reader, CalibrationBias() by default) around
+    # mid-scale, so the reader gets the original values plus the DC level of a real board
+    # drift_ppm makes the simulated board clock run faster (or slower) than the host one and
+    # start_tick is the board time of the first sample in microseconds
+    def __init__(self, samples, fs, speed=1.0, block_size=1000, loop=True, calibration=None, drift_ppm=0.0,
+                 start_tick=0):
+        self._samples = np.asarray(samples)
+        self._fs = fs
+        self._speed = speed
+        self._block_size = block_size
+        self._loop = loop
+        self._calibration = calibration if calibration is not None else CalibrationBias()
+        self._clipped_samples = 0
+        self._drift_ppm = drift_ppm
+        self._start_tick = start_tick
+        self._master = None
+        self._slave = None
+        self._port_name = None
+        self._thread = None
+        self._running = threading.Event()
+
+    # Use the replay as a context manager
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # Define getters
+    # Port to give to ReceptionBias
+    def port_name(self):
+        return self._port_name
+
+    # Samples which didn't fit in the ADC range
+    def clipped_samples(self):
+        return self._clipped_samples
+
+    # ADC counts the firmware would send for a block of the source
+    def adc_values(self, block):
+        if np.issubdtype(block.dtype, np.integer):
+            counts = block
+        else:
+            counts = np.round(self._calibration.invert(block) + ADC_MID_SCALE)
+        clipped = int(np.count_nonzero((counts < 0) | (counts > ADC_MAX_COUNT)))
+        if clipped:
+            if self._clipped_samples == 0:
+                print(f"Warning: replayed samples don't fit in the {ADC_MAX_COUNT + 1} ADC counts and are clipped, "
+                      f"check the calibration")
+            self._clipped_samples += clipped
+        return np.clip(counts, 0, ADC_MAX_COUNT).astype(np.uint16)
+
+    # Open the pseudo-terminal and start writing frames
+    def start(self):
+        if self._running.is_set():
+            return
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self._port_name = os.ttyname(self._slave)
+        self._running.set()
+        self._thread = threading.Thread(target=self._write_loop, name="PtyReplayBias", daemon=True)
+        self._thread.start()
+
+    # Stop writing and close the pseudo-terminal
+    def stop(self):
+        if self._thread is None:
+            return
+        self._running.clear()
+        self._thread.join()
+        self._thread = None
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _write_loop(self):
+        start_time = time.monotonic()
+        sent_samples = 0
+        position = 0
+        sequence = 0
+        while self._running.is_set():
+            if position >= self._samples.shape[1]:
+                if not self._loop:
+                    break
+                position = 0
+            block = self._samples[:, position:position + self._block_size]
+            position += block.shape[1]
+
+            # Same values the firmware would send
+            adc_values = self.adc_values(block)
+            timestamp = self._start_tick + int(sent_samples * 1e6 / self._fs)
+            self._write_all(encode_frame(sequence, adc_values, timestamp=timestamp))
+            sequence += 1
+            sent_samples += block.shape[1]
+
+            if self._speed:
+                # Wait until the next block is due at the selected speed (and the drift of the board clock)
+                due_time = start_time + sent_samples / (self._fs * self._speed * (1 + self._drift_ppm * 1e-6))
+                while self._running.is_set() and time.monotonic() < due_time:
+                    time.sleep(min(due_time - time.monotonic(), 0.1))
+
+    # Write a whole frame, waiting while the pseudo-terminal buffer is full
+    def _write_all(self, data):
+        view = memoryview(data)
+        while view and self._running.is_set():
+            _, writable, _ = select.select([], [self._master], [], 0.1)
+            if writable:
+                view = view[os.write(self._master, view):]
+
+if __name__ == "__main__":
+    main()
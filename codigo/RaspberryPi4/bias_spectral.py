@@ -0,0 +1,169 @@
+import functools
+import numpy as np
+from scipy.signal import get_window
+
+# EEG bands (name -> (low, high) Hz), in the order of the band axis of the spectral plans and ProcessingBias
+EEG_BANDS = {
+    "alpha": (8, 13),
+    "beta": (13, 30),
+    "gamma": (30, 100),
+    "delta": (0.5, 4),
+    "theta": (4, 8)
+}
+
+# Spectral plan of windows of n samples at fs for a table of bands
+# The plans are cached, so ProcessingBias, AIBias and Umbrales share the same arrays (they must not be modified)
+def get_spectral_plan(n, fs, bands=None):
+    bands = EEG_BANDS if bands is None else bands
+    return _spectral_plan(int(n), fs, tuple((name, tuple(band_range)) for name, band_range in bands.items()))
+
+@functools.lru_cache(maxsize=64)
+def _spectral_plan(n, fs, bands):
+    return SpectralPlanBias(n=n, fs=fs, bands=dict(bands))
+
+# Everything about the spectrum of a window that doesn't depend on its samples: frequency grid, band masks, time axis
+# and tapering windows
+class SpectralPlanBias:
+    # Constructor
+    def __init__(self, n, fs, bands):
+        self._n = n
+        self._fs = fs
+        self._bands = dict(bands)
+        # Frequencies of the bins of the rfft
+        self._frequencies = np.fft.rfftfreq(n, d=1/fs)
+        # Bands x bins mask which keeps the bins of each band
+        self._band_mask = np.array([(self._frequencies >= low) & (self._frequencies <= high)
+                                    for low, high in self._bands.values()]).reshape(len(self._bands), -1)
+        if n % 2 == 0:
+            # The full FFT counts the Nyquist bin as a negative frequency, so it never belongs to a band
+            self._band_mask[:, -1] = False
+        # Time of each sample from the beginning of the window
+        self._times = np.arange(n) / fs
+        self._windows = {}
+        for array in (self._frequencies, self._band_mask, self._times):
+            array.flags.writeable = False
+
+    # Define getters
+    def n(self):
+        return self._n
+
+    def fs(self):
+        return self._fs
+
+    def bands(self):
+        return dict(self._bands)
+
+    def band_names(self):
+        return list(self._bands)
+
+    def frequencies(self):
+        return self._frequencies
+
+    def band_mask(self):
+        return self._band_mask
+
+    def times(self):
+        return self._times
+
+    # Tapering window of n samples (e.g. 'hann', the default of welch and spectrogram), computed once per name
+    def window(self, name='hann'):
+        if name not in self._windows:
+            window = get_window(name, self._n)
+            window.flags.writeable = False
+            self._windows[name] = window
+        return self._windows[name]
+
+# Band power of every channel tracked continuously over a stream: a STFT frame every hop samples (hop = fs / rate)
+# Each frame costs one rfft per channel whatever the length of the chunks, and the band power is the average of the
+# last `average` frames (like welch over the newest frame + (average - 1) hops of samples)
+class SlidingBandPowerBias:
+    # Constructor
+    # frame is the length of each STFT frame in samples (half a second by default) and rate the band powers per second
+    def __init__(self, channels, fs, rate=20, frame=None, average=4, bands=None, window='hann'):
+        self._channels = channels
+        self._fs = fs
+        self._frame = int(frame) if frame is not None else int(fs // 2)
+        self._hop = max(1, int(round(fs / rate)))
+        if self._hop > self._frame:
+            raise ValueError(f"A rate of {rate} band powers per second skips samples with frames of {self._frame}")
+        if average < 1:
+            raise ValueError("average must be positive")
+        self._average = average
+        self._plan = get_spectral_plan(self._frame, fs, bands)
+        self._window = self._plan.window(window)
+        # Bins x bands weights which turn |X|^2 into the power of each band (density of welch integrated over the band)
+        # Every bin but DC and Nyquist stands for a positive and a negative frequency
+        weights = np.full(len(self._plan.frequencies()), 2.0)
+        weights[0] = 1.0
+        if self._frame % 2 == 0:
+            weights[-1] = 1.0
+        self._band_weights = (self._plan.band_mask() * weights / (self._frame * np.sum(self._window ** 2))).T
+        self.reset()
+
+    # Forget the stream, the next samples start a new one
+    def reset(self):
+        # Samples not used yet by a frame (they start at the next frame)
+        self._pending = np.empty((self._channels, 0))
+        # Absolute index of the first pending sample
+        self._next_frame_start = 0
+        # Ring with the band power of the last frames
+        self._frames = np.zeros((self._average, self._channels, len(self._plan.band_names())))
+        self._number_of_frames = 0
+        self._latest = None
+        self._latest_time = None
+
+    # Define getters
+    def hop(self):
+        return self._hop
+
+    def frame(self):
+        return self._frame
+
+    def rate(self):
+        return self._fs / self._hop
+
+    def band_names(self):
+        return self._plan.band_names()
+
+    # Newest band power (channels x bands) and time of the last sample it includes (None before the first frame)
+    def latest(self):
+        return self._latest
+
+    def latest_time(self):
+        return self._latest_time
+
+    # {ch: {band: power}} of the newest band power
+    def band_powers(self):
+        if self._latest is None:
+            return None
+        return {f'ch{ch}': {band_name: float(self._latest[ch, number]) for number, band_name in enumerate(self.band_names())}
+                for ch in range(self._channels)}
+
+    # Add the next chunk (channels x samples, any length) of the stream
+    # Returns the times (seconds since the start of the stream, end of each frame) and the band powers
+    # (times x channels x bands) of every frame completed by the chunk
+    def push(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim == 1:
+            block = block.reshape(1, -1)
+        data = np.concatenate([self._pending, block], axis=-1)
+        number_of_frames = (data.shape[-1] - self._frame) // self._hop + 1 if data.shape[-1] >= self._frame else 0
+        band_power = np.empty((number_of_frames, self._channels, self._frames.shape[-1]))
+        times = (self._next_frame_start + np.arange(number_of_frames) * self._hop + self._frame) / self._fs
+        if number_of_frames > 0:
+            # Every frame of every channel in one rfft (the frames are views of the samples)
+            frames = np.lib.stride_tricks.sliding_window_view(data, self._frame, axis=-1)[:, ::self._hop][:, :number_of_frames]
+            spectrum = np.fft.rfft(frames * self._window, axis=-1)
+            frame_power = (np.abs(spectrum) ** 2) @ self._band_weights
+            for number in range(number_of_frames):
+                # Replace the oldest frame of the ring and average the ones filled so far
+                self._frames[self._number_of_frames % self._average] = frame_power[:, number]
+                self._number_of_frames += 1
+                band_power[number] = self._frames[:min(self._number_of_frames, self._average)].mean(axis=0)
+            self._latest = band_power[-1]
+            self._latest_time = float(times[-1])
+        # Keep the samples of the next frames
+        consumed = number_of_frames * self._hop
+        self._pending = data[:, consumed:]
+        self._next_frame_start += consumed
+        return times, band_power
@@ -0,0 +1,101 @@
+import time
+import threading
+
+class ReceptionStatsBias:
+    # Constructor
+    # callback receives a snapshot (dict) every `interval` seconds while frames arrive
+    def __init__(self, callback=None, interval=1.0):
+        self._callback = callback
+        self._interval = interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    # Start counting from zero
+    def reset(self):
+        with self._lock:
+            self._start_time = time.monotonic()
+            self._total_bytes = 0
+            self._total_frames = 0
+            self._total_samples = 0
+            self._missing_frames = 0
+            self._sequence_resets = 0
+            self._last_sequence = None
+            self._last_frame_time = None
+            self._max_frame_gap = 0.0
+
+            # Counters at the last report, to calculate the current rates
+            self._report_time = self._start_time
+            self._report_bytes = 0
+            self._report_frames = 0
+
+    # Count the bytes of one read of the port
+    def record_bytes(self, number_of_bytes):
+        with self._lock:
+            self._total_bytes += number_of_bytes
+
+    # Count a decoded frame and check its sequence number
+    def record_frame(self, frame, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._total_frames += 1
+            self._total_samples += frame.samples.shape[1]
+
+            # Longest time without frames
+            if self._last_frame_time is not None:
+                self._max_frame_gap = max(self._max_frame_gap, now - self._last_frame_time)
+            self._last_frame_time = now
+
+            # JSON frames don't have a sequence number
+            if frame.sequence is not None:
+                if self._last_sequence is not None:
+                    jump = (frame.sequence - self._last_sequence - 1) & 0xFFFFFFFF
+                    if jump < 0x80000000:
+                        self._missing_frames += jump
+                    else:
+                        # The board restarted (or frames arrived out of order)
+                        self._sequence_resets += 1
+                self._last_sequence = frame.sequence
+
+    # Call the callback if the interval has passed
+    def maybe_report(self, parser=None, buffer=None):
+        if self._callback is None or time.monotonic() - self._report_time < self._interval:
+            return
+        self._callback(self.snapshot(parser=parser, buffer=buffer, mark_report=True))
+
+    # Current values of every counter and rate
+    def snapshot(self, parser=None, buffer=None, mark_report=False):
+        now = time.monotonic()
+        with self._lock:
+            elapsed_time = now - self._start_time
+            interval = now - self._report_time
+            stats = {
+                'elapsed_time': elapsed_time,
+                'bytes': self._total_bytes,
+                'frames': self._total_frames,
+                'samples': self._total_samples,
+                'bytes_per_second': self._total_bytes / elapsed_time if elapsed_time > 0 else 0.0,
+                'frames_per_second': self._total_frames / elapsed_time if elapsed_time > 0 else 0.0,
+                # Rates since the last report
+                'current_bytes_per_second': (self._total_bytes - self._report_bytes) / interval if interval > 0 else 0.0,
+                'current_frames_per_second': (self._total_frames - self._report_frames) / interval if interval > 0 else 0.0,
+                'missing_frames': self._missing_frames,
+                'sequence_resets': self._sequence_resets,
+                'max_frame_gap': self._max_frame_gap,
+            }
+            if mark_report:
+                self._report_time = now
+                self._report_bytes = self._total_bytes
+                self._report_frames = self._total_frames
+
+        # Errors seen by the parser
+        if parser is not None:
+            stats['decode_failures'] = parser.decode_failures()
+            stats['resync_events'] = parser.resync_events()
+            stats['pending_bytes'] = parser.pending_bytes()
+
+        # How full the buffer is and how much was overwritten before being read
+        # A shared bus is read by other processes with their own read indexes, the writer can't know how they go
+        if buffer is not None and not buffer.is_shared():
+            stats['buffer_fill'] = buffer.available() / buffer.capacity()
+            stats['overrun_samples'] = buffer.overrun_samples()
+        return stats
@@ -1,6 +1,7 @@
 from bci_iv_2a import MotorImageryDataset
 import numpy as np
 from scipy.signal import butter, filtfilt, spectrogram
+from bias_spectral import get_spectral_plan
 
 antes_total03 = 0
 despues_total03 = 0
@@ -48,6 +49,10 @@ class Umbrales:
     def spectrogram_by_band(self, signal, fs, window, noverlap, nfft):
         
         spectrograms = { 'Delta': [], 'Theta': [], 'Alpha': [], 'Beta': [], 'Gamma': [] }
+
+        # Same window for every band (and every call with the same segment length and fs), segments of 256 samples
+        if isinstance(window, str):
+            window = get_spectral_plan(min(256, len(signal)), fs, self.bands).window(window)
         
         for band, (low, high) in self.bands.items():
             filtered_signal = self.apply_band_pass_filter(signal, low, high, fs)